@@ -1,19 +1,26 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import _strptime  # noqa, strptime lazy import is not thread safe in py2
 import abc
 import hashlib
-import json
+import hmac
 import logging
 import numbers
+import random
+import time
 import uuid
 from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
-from datetime import datetime
+from SocketServer import ThreadingMixIn
+from datetime import datetime, timedelta
 from optparse import OptionParser
 from abc import abstractproperty, abstractmethod
 
+import codec
+import metrics
 import scoring
-from store import Store
+from store import (Store, PrefetchedStore, LocalCopyStore,
+                   NEGATIVE_CACHE_SECONDS)
 
 CLIENTS_INTERESTS_METHOD = 'clients_interests'
 
@@ -49,6 +56,61 @@ GENDERS = {
     FEMALE: "female",
 }
 DATE_PATTERN = '%d.%m.%Y'
+MAX_BATCH_SIZE = 100
+METRICS_METHODS = {CLIENTS_INTERESTS_METHOD, ONLINE_SCORE_METHOD}
+UNKNOWN_METRICS_METHOD = 'unknown'
+BATCH_METRICS_METHOD = 'batch'
+AUTH_CACHE_SIZE = 10000
+
+
+def _to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+class AuthCache(object):
+    """Keeps tokens that were already verified and the admin digest of the
+    current hour, so that sha512 is not recomputed on every request."""
+
+    def __init__(self, max_size=AUTH_CACHE_SIZE):
+        self.max_size = max_size
+        self._verified = set()
+        self._admin_digest = None
+        self._admin_digest_expires_at = 0
+
+    def clear(self):
+        self._verified.clear()
+        self._admin_digest = None
+        self._admin_digest_expires_at = 0
+
+    def admin_digest(self):
+        if time.time() >= self._admin_digest_expires_at:
+            now = datetime.now()
+            hour_start = now.replace(minute=0, second=0, microsecond=0)
+            self._admin_digest = hashlib.sha512(
+                now.strftime("%Y%m%d%H") + ADMIN_SALT).hexdigest()
+            self._admin_digest_expires_at = time.mktime(
+                (hour_start + timedelta(hours=1)).timetuple())
+        return self._admin_digest
+
+    def check_admin(self, token):
+        return hmac.compare_digest(self.admin_digest(), _to_bytes(token))
+
+    def check_user(self, account, login, token):
+        key = (account, login, token)
+        if key in self._verified:
+            return True
+        digest = hashlib.sha512(account + login + SALT).hexdigest()
+        if not hmac.compare_digest(digest, _to_bytes(token)):
+            return False
+        if len(self._verified) >= self.max_size:
+            self._verified.clear()
+        self._verified.add(key)
+        return True
+
+
+auth_cache = AuthCache()
 
 
 class WithCheckedFields(type):
@@ -191,6 +253,10 @@ class BaseRequest(object):
         raise NotImplementedError('Subclasses of BaseRequest should implement '
                                   'handle method.')
 
+    def cache_keys(self, base_request):
+        """Store keys that handle is going to read, used for prefetching."""
+        return []
+
 
 class ClientsInterestsRequest(BaseRequest):
     client_ids = ClientIDsField(required=True)
@@ -203,6 +269,9 @@ class ClientsInterestsRequest(BaseRequest):
             response[client_id] = scoring.get_interests(cache_store, client_id)
         return response, OK
 
+    def cache_keys(self, base_request):
+        return [scoring.get_interests_key(cid) for cid in self.client_ids]
+
 
 class OnlineScoreRequest(BaseRequest):
     first_name = CharField(required=False, nullable=True)
@@ -224,6 +293,12 @@ class OnlineScoreRequest(BaseRequest):
         response = {'score': score}
         return response, OK
 
+    def cache_keys(self, base_request):
+        if base_request.is_admin or not self.birthday:
+            return []
+        date = datetime.strptime(self.birthday, DATE_PATTERN)
+        return [scoring.get_score_key(self.first_name, self.last_name, date)]
+
 
 class MethodRequest(BaseRequest):
     account = CharField(required=False, nullable=True)
@@ -237,25 +312,24 @@ class MethodRequest(BaseRequest):
         return self.login == ADMIN_LOGIN
 
     def check_auth(self):
+        if self.token is None:
+            return False
         if self.login == ADMIN_LOGIN:
-            digest = hashlib.sha512(datetime.now()
-                                    .strftime(
-                "%Y%m%d%H") + ADMIN_SALT).hexdigest()
-        else:
-            digest = hashlib.sha512(self.account +
-                                    self.login + SALT).hexdigest()
-        if digest == self.token:
-            return True
-        return False
+            return auth_cache.check_admin(self.token)
+        return auth_cache.check_user(self.account, self.login, self.token)
+
+    def get_method_request(self):
+        if self.method == CLIENTS_INTERESTS_METHOD:
+            return ClientsInterestsRequest(**self.arguments)
+        elif self.method == ONLINE_SCORE_METHOD:
+            return OnlineScoreRequest(**self.arguments)
+        return None
 
     def handle(self, base_request, ctx, cache_store):
         if not self.check_auth():
             return 'Invalid token', FORBIDDEN
-        if self.method == CLIENTS_INTERESTS_METHOD:
-            method_request = ClientsInterestsRequest(**self.arguments)
-        elif self.method == ONLINE_SCORE_METHOD:
-            method_request = OnlineScoreRequest(**self.arguments)
-        else:
+        method_request = self.get_method_request()
+        if method_request is None:
             return 'Unknown method', INVALID_REQUEST
         return method_request.handle(self, ctx, cache_store)
 
@@ -265,29 +339,147 @@ def main_method_handler(request_params, ctx, cache_store):
                                                           cache_store)
 
 
+def _format_result(code, response):
+    if code not in ERRORS:
+        return {"response": response, "code": code}
+    return {"error": response or ERRORS.get(code, "Unknown Error"),
+            "code": code}
+
+
+def batch_method_handler(request_params, ctx, cache_store):
+    """Handles a list of method requests sent in one body.
+
+    Every request is validated and authenticated once, then the store keys
+    needed by all of them are fetched with a single multi-get and the
+    requests are executed one by one, each getting its own result and code.
+    """
+    body = request_params['body']
+    if not isinstance(body, list):
+        raise ValueError('Batch request body must be a list of requests.')
+    if len(body) > MAX_BATCH_SIZE:
+        raise ValueError('Batch request can contain at most %d requests.'
+                         % MAX_BATCH_SIZE)
+    results = [None] * len(body)
+    prepared = []
+    keys = []
+    for i, params in enumerate(body):
+        try:
+            if not isinstance(params, dict):
+                raise ValueError('Batch item must be a valid json object.')
+            method_request = MethodRequest(**params)
+            if not method_request.check_auth():
+                results[i] = _format_result(FORBIDDEN, 'Invalid token')
+                continue
+            request = method_request.get_method_request()
+            if request is None:
+                results[i] = _format_result(INVALID_REQUEST, 'Unknown method')
+                continue
+            keys.extend(request.cache_keys(method_request))
+        except (TypeError, ValueError) as e:
+            results[i] = _format_result(INVALID_REQUEST, e.message)
+            continue
+        prepared.append((i, method_request, request))
+
+    batch_store = PrefetchedStore(cache_store, keys)
+    ctx['items'] = []
+    for i, method_request, request in prepared:
+        item_ctx = {}
+        ctx['items'].append(item_ctx)
+        try:
+            response, code = request.handle(method_request, item_ctx,
+                                            batch_store)
+        except (TypeError, ValueError) as e:
+            response, code = e.message, INVALID_REQUEST
+        except Exception as e:
+            logging.exception("Unexpected error in batch item: %s" % e)
+            response, code = None, INTERNAL_ERROR
+        results[i] = _format_result(code, response)
+    return results, OK
+
+
+def metrics_handler(request_params, ctx, cache_store):
+    return metrics.REGISTRY.render(), OK
+
+
+def _metrics_method(path, request_dict):
+    """Label for request metrics, limited to known values."""
+    if path == "method/batch":
+        return BATCH_METRICS_METHOD
+    method = None
+    if isinstance(request_dict, dict):
+        method = request_dict.get('method')
+    if method in METRICS_METHODS:
+        return method
+    return UNKNOWN_METRICS_METHOD
+
+
 class MainHTTPHandler(BaseHTTPRequestHandler):
     router = {
-        "method": main_method_handler
+        "method": main_method_handler,
+        "method/batch": batch_method_handler,
     }
-    cache_store = Store()
+    # GET routes that respond with plain text instead of json
+    text_router = {
+        "metrics": metrics_handler,
+    }
+    cache_store = LocalCopyStore(Store())
+    json_codec = codec.get_codec()
+    # share of request and response bodies written to the log, from 0 (none)
+    # to 1 (all)
+    body_log_rate = 1.0
 
     def get_request_id(self, headers):
         return headers.get('HTTP_X_REQUEST_ID', uuid.uuid4().hex)
 
+    def body_is_logged(self):
+        """Samples body_log_rate share of bodies, none below INFO level."""
+        if self.body_log_rate <= 0 or not logging.getLogger().isEnabledFor(
+                logging.INFO):
+            return False
+        return self.body_log_rate >= 1 or random.random() < self.body_log_rate
+
+    def log_request_body(self, data_string, context):
+        if self.body_is_logged():
+            logging.info("%s: %s %s", self.path, data_string,
+                         context["request_id"])
+
+    def log_response(self, code, context):
+        """Logs the context with the response body when sampled like
+        request bodies, otherwise only the request id and code."""
+        if self.body_is_logged():
+            logging.info(context)
+        else:
+            logging.info("%s: %s", context["request_id"], code)
+
+    def do_GET(self):
+        path = self.path.strip("/")
+        if path not in self.text_router:
+            self.send_error(NOT_FOUND)
+            return
+        response, code = self.text_router[path](
+            {"headers": self.headers}, {}, self.cache_store)
+        self.send_response(code)
+        self.send_header("Content-Type", metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
     def do_POST(self):
+        self.started = time.time()
+        self.metrics_method = UNKNOWN_METRICS_METHOD
         context = {"request_id": self.get_request_id(self.headers)}
         response, code = {}, OK
         try:
             data_string = self.rfile.read(int(self.headers['Content-Length']))
-            request_dict = json.loads(data_string)
+            request_dict = self.json_codec.loads(data_string)
         except Exception:
             self.handle_response(BAD_REQUEST, {}, context)
             return
         if data_string:
-            logging.info("%s: %s %s" % (self.path, data_string,
-                                        context["request_id"]))
+            self.log_request_body(data_string, context)
         if request_dict:
             path = self.path.strip("/")
+            self.metrics_method = _metrics_method(path, request_dict)
             if path in self.router:
                 try:
                     response, code = self.router[path](
@@ -309,26 +501,44 @@ class MainHTTPHandler(BaseHTTPRequestHandler):
         self.send_response(code)
         self.send_header("Content-Type", "application/json")
         self.end_headers()
-        if code not in ERRORS:
-            r = {"response": response, "code": code}
-        else:
-            r = {"error": response or ERRORS.get(code, "Unknown Error"),
-                 "code": code}
+        r = _format_result(code, response)
         context.update(r)
-        logging.info(context)
-        self.wfile.write(json.dumps(r))
+        self.log_response(code, context)
+        self.wfile.write(self.json_codec.dumps(r))
+        metrics.REQUESTS.inc(self.metrics_method, code)
+        metrics.REQUEST_LATENCY.observe(time.time() - self.started,
+                                        self.metrics_method)
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """Handles every request in its own thread, so a request waiting on the
+    store doesn't hold up the others and concurrent score cache misses are
+    coalesced by scoring."""
+    daemon_threads = True
 
 
 if __name__ == "__main__":
     op = OptionParser()
     op.add_option("-p", "--port", action="store", type=int, default=8080)
     op.add_option("-l", "--log", action="store", default=None)
+    op.add_option("-c", "--codec", action="store", default=codec.DEFAULT_CODEC)
+    op.add_option("--log-body-rate", action="store", type=float, default=1.0)
+    op.add_option("--negative-ttl", action="store", type=float,
+                  default=NEGATIVE_CACHE_SECONDS,
+                  help="seconds ids the store confirmed missing fail right "
+                       "away, keep it well above a retry cycle of the "
+                       "store; ids not retrieved while the store is "
+                       "unavailable fail for a poll timeout only")
     (opts, args) = op.parse_args()
+    MainHTTPHandler.cache_store = LocalCopyStore(
+        Store(), negative_ttl=opts.negative_ttl)
+    MainHTTPHandler.json_codec = codec.get_codec(opts.codec)
+    MainHTTPHandler.body_log_rate = opts.log_body_rate
 
     logging.basicConfig(filename=opts.log, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s',
                         datefmt='%Y.%m.%d %H:%M:%S')
-    server = HTTPServer(("localhost", opts.port), MainHTTPHandler)
+    server = ThreadingHTTPServer(("localhost", opts.port), MainHTTPHandler)
 
     logging.info("Starting server at %s" % opts.port)
     try:
@@ -0,0 +1,49 @@
+import json
+
+DEFAULT_CODEC = 'json'
+AUTO_CODEC = 'auto'
+# faster backends are picked by 'auto' in this order when installed
+PREFERRED_CODECS = ['ujson', 'simplejson', DEFAULT_CODEC]
+
+
+class JsonCodec(object):
+    """Thin wrapper around a json-compatible module with loads/dumps."""
+
+    def __init__(self, name, module):
+        self.name = name
+        self.module = module
+
+    def loads(self, data):
+        return self.module.loads(data)
+
+    def dumps(self, obj):
+        return self.module.dumps(obj)
+
+
+def _load_codecs():
+    codecs = {DEFAULT_CODEC: JsonCodec(DEFAULT_CODEC, json)}
+    for name in PREFERRED_CODECS:
+        if name in codecs:
+            continue
+        try:
+            module = __import__(name)
+        except ImportError:
+            continue
+        codecs[name] = JsonCodec(name, module)
+    return codecs
+
+
+CODECS = _load_codecs()
+
+
+def get_codec(name=DEFAULT_CODEC):
+    """Returns codec by name, 'auto' picks the fastest installed one."""
+    if name == AUTO_CODEC:
+        for preferred in PREFERRED_CODECS:
+            if preferred in CODECS:
+                return CODECS[preferred]
+    if name not in CODECS:
+        raise ValueError("Unknown or not installed json codec '%s', "
+                         "available codecs: %s" %
+                         (name, ', '.join(sorted(CODECS))))
+    return CODECS[name]
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""In-process memcached stand-in speaking the text protocol.
+
+Supports the commands used by python-memcached for the scoring server:
+get/gets, set, add, replace, delete, incr/decr, touch, flush_all, stats and
+version. Latency and failures can be injected to exercise Store retries.
+"""
+
+import logging
+import random
+import threading
+import time
+from SocketServer import ThreadingTCPServer, StreamRequestHandler
+from optparse import OptionParser
+
+# exptime values above this are absolute unix timestamps
+MAX_RELATIVE_EXPTIME = 60 * 60 * 24 * 30
+FAILURE_MODES = ('error', 'close')
+
+
+class FakeMemcachedHandler(StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.split()
+            if not parts:
+                continue
+            command, args = parts[0].lower(), parts[1:]
+            data = None
+            if command in self.server.STORAGE_COMMANDS:
+                if len(args) < 4 or not args[3].isdigit():
+                    self.wfile.write(
+                        'CLIENT_ERROR bad command line format\r\n')
+                    continue
+                data = self.rfile.read(int(args[3]) + 2)[:-2]
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            if self.server.should_fail():
+                if self.server.failure_mode == 'close':
+                    return
+                self.wfile.write('SERVER_ERROR injected failure\r\n')
+                continue
+            if command == 'quit':
+                return
+            response = self.server.execute(command, args, data)
+            if response is not None:
+                self.wfile.write(response)
+
+
+class FakeMemcached(ThreadingTCPServer):
+    """Threaded memcached fake, bind to port 0 to get a free port."""
+    allow_reuse_address = True
+    daemon_threads = True
+    STORAGE_COMMANDS = ('set', 'add', 'replace')
+
+    def __init__(self, address=('localhost', 0), latency=0, failure_rate=0,
+                 failure_mode='error'):
+        ThreadingTCPServer.__init__(self, address, FakeMemcachedHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        if failure_mode not in FAILURE_MODES:
+            raise ValueError('Unknown failure mode %s' % failure_mode)
+        self.failure_mode = failure_mode
+        self.lock = threading.Lock()
+        self.data = {}
+        self.stats = dict.fromkeys(['cmd_get', 'cmd_set', 'get_hits',
+                                    'get_misses', 'total_items'], 0)
+        self._thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+    def should_fail(self):
+        return self.failure_rate and random.random() < self.failure_rate
+
+    def _expires_at(self, exptime):
+        exptime = int(exptime)
+        if exptime == 0:
+            return None
+        if exptime < 0:
+            return 0
+        if exptime > MAX_RELATIVE_EXPTIME:
+            return exptime
+        return time.time() + exptime
+
+    def _lookup(self, key):
+        item = self.data.get(key)
+        if item is None:
+            return None
+        flags, value, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            del self.data[key]
+            return None
+        return item
+
+    def execute(self, command, args, data):
+        noreply = len(args) > 0 and args[-1] == 'noreply'
+        if noreply:
+            args = args[:-1]
+        with self.lock:
+            response = self._execute(command, args, data)
+        return None if noreply else response
+
+    def _execute(self, command, args, data):
+        if command in ('get', 'gets'):
+            lines = []
+            for key in args:
+                self.stats['cmd_get'] += 1
+                item = self._lookup(key)
+                if item is None:
+                    self.stats['get_misses'] += 1
+                    continue
+                self.stats['get_hits'] += 1
+                flags, value, _ = item
+                lines.append('VALUE %s %s %d\r\n%s\r\n' % (
+                    key, flags, len(value), value))
+            return ''.join(lines) + 'END\r\n'
+        if command in self.STORAGE_COMMANDS:
+            key, flags, exptime = args[:3]
+            self.stats['cmd_set'] += 1
+            exists = self._lookup(key) is not None
+            if command == 'add' and exists:
+                return 'NOT_STORED\r\n'
+            if command == 'replace' and not exists:
+                return 'NOT_STORED\r\n'
+            self.data[key] = (flags, data, self._expires_at(exptime))
+            self.stats['total_items'] += 1
+            return 'STORED\r\n'
+        if command == 'delete' and args:
+            if self._lookup(args[0]) is None:
+                return 'NOT_FOUND\r\n'
+            del self.data[args[0]]
+            return 'DELETED\r\n'
+        if command in ('incr', 'decr') and len(args) == 2:
+            item = self._lookup(args[0])
+            if item is None:
+                return 'NOT_FOUND\r\n'
+            flags, value, expires_at = item
+            if not value.isdigit():
+                return ('CLIENT_ERROR cannot increment or decrement '
+                        'non-numeric value\r\n')
+            delta = int(args[1]) if command == 'incr' else -int(args[1])
+            value = str(max(int(value) + delta, 0))
+            self.data[args[0]] = (flags, value, expires_at)
+            return value + '\r\n'
+        if command == 'touch' and len(args) == 2:
+            item = self._lookup(args[0])
+            if item is None:
+                return 'NOT_FOUND\r\n'
+            flags, value, _ = item
+            self.data[args[0]] = (flags, value, self._expires_at(args[1]))
+            return 'TOUCHED\r\n'
+        if command == 'flush_all':
+            self.data.clear()
+            return 'OK\r\n'
+        if command == 'stats':
+            stats = dict(self.stats, curr_items=len(self.data))
+            return ''.join('STAT %s %s\r\n' % (name, value) for name, value
+                           in sorted(stats.items())) + 'END\r\n'
+        if command == 'version':
+            return 'VERSION fake\r\n'
+        return 'ERROR\r\n'
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-p", "--port", action="store", type=int, default=11211)
+    op.add_option("--latency", action="store", type=float, default=0)
+    op.add_option("--failure-rate", action="store", type=float, default=0)
+    op.add_option("--failure-mode", action="store", default='error',
+                  choices=FAILURE_MODES)
+    (opts, args) = op.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(asctime)s] %(levelname).1s %(message)s',
+                        datefmt='%Y.%m.%d %H:%M:%S')
+    server = FakeMemcached(('localhost', opts.port), opts.latency,
+                           opts.failure_rate, opts.failure_mode)
+    logging.info("Starting fake memcached at %s" % opts.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
@@ -0,0 +1,223 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Load generator for the scoring server.
+
+Drives the `method` endpoint with a mix of online_score and
+clients_interests requests from several threads and reports latency
+percentiles, RPS and response codes. Without --url it starts the server
+in-process, optionally backed by the fake memcached.
+"""
+
+import _strptime  # noqa, strptime lazy import is not thread safe in py2
+import httplib
+import json
+import logging
+import random
+import threading
+import time
+import urlparse
+from BaseHTTPServer import HTTPServer
+from collections import Counter
+from optparse import OptionParser
+
+import api
+from fake_memcached import FakeMemcached
+from store import LocalCopyStore, Store
+
+ACCOUNT = 'account1'
+LOGIN = 'login'
+TOKEN = ('178a72ced8d6581bc798d502288f9d29dd211c49231588656a1e72bc0123425d89'
+         '4808d42be9627d589b45851061173be3b215f44e503d0edc89ec6a6e65280f')
+INTERESTS = ['cars', 'pets', 'travel', 'hi-tech', 'sport', 'music', 'books',
+             'tv', 'cinema', 'geek', 'otus']
+CLIENTS_COUNT = 1000
+FIRST_NAMES = ['Egor', 'Ivan', 'Anna', 'Maria', 'Petr']
+
+
+class QuietHandler(api.MainHTTPHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+def score_request():
+    return {
+        'account': ACCOUNT, 'login': LOGIN, 'token': TOKEN,
+        'method': api.ONLINE_SCORE_METHOD,
+        'arguments': {
+            'phone': '71234567890', 'email': 'load@test.hz',
+            'first_name': random.choice(FIRST_NAMES), 'last_name': 'Test',
+            'birthday': '01.01.%d' % random.randint(1960, 2000), 'gender': 1,
+        },
+    }
+
+
+def interests_request(clients_per_request):
+    return {
+        'account': ACCOUNT, 'login': LOGIN, 'token': TOKEN,
+        'method': api.CLIENTS_INTERESTS_METHOD,
+        'arguments': {
+            'client_ids': random.sample(range(1, CLIENTS_COUNT + 1),
+                                        clients_per_request),
+            'date': '01.01.2018',
+        },
+    }
+
+
+def seed_interests(store):
+    for cid in range(1, CLIENTS_COUNT + 1):
+        store.cache_set('i:%s' % cid, json.dumps(random.sample(INTERESTS, 2)),
+                        0)
+
+
+def percentile(sorted_values, share):
+    if not sorted_values:
+        return 0
+    index = min(int(len(sorted_values) * share), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+class LoadGenerator(object):
+
+    def __init__(self, url, concurrency, requests_count, interests_share=0.5,
+                 clients_per_request=4):
+        parsed = urlparse.urlparse(url)
+        self.host, self.port = parsed.hostname, parsed.port or 80
+        self.path = parsed.path or '/'
+        self.concurrency = concurrency
+        self.requests_count = requests_count
+        self.interests_share = interests_share
+        self.clients_per_request = clients_per_request
+        self.latencies = []
+        self.codes = Counter()
+        self._lock = threading.Lock()
+        self._remaining = requests_count
+
+    def _next(self):
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            return True
+
+    def _request(self):
+        if random.random() < self.interests_share:
+            body = interests_request(self.clients_per_request)
+        else:
+            body = score_request()
+        body = json.dumps(body)
+        started = time.time()
+        try:
+            connection = httplib.HTTPConnection(self.host, self.port)
+            connection.request('POST', self.path, body,
+                               {'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            connection.close()
+            status = response.status
+        except (httplib.HTTPException, IOError) as e:
+            logging.debug('Request failed: %s', e)
+            status = 'error'
+        return time.time() - started, status
+
+    def _worker(self):
+        while self._next():
+            latency, status = self._request()
+            with self._lock:
+                self.latencies.append(latency)
+                self.codes[status] += 1
+
+    def run(self):
+        threads = [threading.Thread(target=self._worker)
+                   for _ in range(self.concurrency)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+        latencies = sorted(self.latencies)
+        return {
+            'requests': len(latencies),
+            'elapsed': elapsed,
+            'rps': len(latencies) / elapsed if elapsed else 0,
+            'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99),
+            'max': latencies[-1] if latencies else 0,
+            'codes': dict(self.codes),
+        }
+
+
+def start_local_server(opts):
+    """Starts fake memcached and the scoring server in background threads."""
+    memcached = None
+    port = None
+    if opts.fake_memcached:
+        memcached = FakeMemcached(latency=opts.memcached_latency,
+                                  failure_rate=opts.memcached_failure_rate,
+                                  failure_mode=opts.memcached_failure_mode)
+        memcached.start()
+        port = memcached.port
+    store = Store(attempts=opts.attempts, poll_timeout=opts.poll_timeout,
+                  port=port)
+    if memcached:
+        # seed before injected failures affect the data
+        failure_rate, memcached.failure_rate = memcached.failure_rate, 0
+        latency, memcached.latency = memcached.latency, 0
+        seed_interests(store)
+        memcached.failure_rate, memcached.latency = failure_rate, latency
+    QuietHandler.cache_store = LocalCopyStore(store)
+    QuietHandler.body_log_rate = 0
+    server_class = api.ThreadingHTTPServer if opts.threaded else HTTPServer
+    server = server_class(('localhost', 0), QuietHandler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    url = 'http://localhost:%d/method/' % server.server_address[1]
+    return url, server, memcached
+
+
+if __name__ == "__main__":
+    op = OptionParser()
+    op.add_option("-u", "--url", action="store", default=None,
+                  help="scoring server method url, local server if omitted")
+    op.add_option("-c", "--concurrency", action="store", type=int, default=8)
+    op.add_option("-n", "--requests", action="store", type=int, default=1000)
+    op.add_option("--interests-share", action="store", type=float,
+                  default=0.5)
+    op.add_option("--clients-per-request", action="store", type=int,
+                  default=4)
+    op.add_option("--threaded", action="store_true", default=False,
+                  help="serve local server requests in threads")
+    op.add_option("--fake-memcached", action="store_true", default=False)
+    op.add_option("--memcached-latency", action="store", type=float,
+                  default=0)
+    op.add_option("--memcached-failure-rate", action="store", type=float,
+                  default=0)
+    op.add_option("--memcached-failure-mode", action="store",
+                  default='error')
+    op.add_option("--attempts", action="store", type=int, default=3)
+    op.add_option("--poll-timeout", action="store", type=float, default=0.01)
+    (opts, args) = op.parse_args()
+    logging.basicConfig(level=logging.WARNING,
+                        format='[%(asctime)s] %(levelname).1s %(message)s',
+                        datefmt='%Y.%m.%d %H:%M:%S')
+    server = memcached = None
+    url = opts.url
+    if url is None:
+        url, server, memcached = start_local_server(opts)
+    report = LoadGenerator(url, opts.concurrency, opts.requests,
+                           opts.interests_share,
+                           opts.clients_per_request).run()
+    print('requests: %(requests)d in %(elapsed).2f s, rps: %(rps).1f' %
+          report)
+    print('latency p50: %.2f ms, p99: %.2f ms, max: %.2f ms' % (
+        report['p50'] * 1000, report['p99'] * 1000, report['max'] * 1000))
+    print('codes: %s' % ', '.join('%s: %d' % item for item
+                                  in sorted(report['codes'].items())))
+    if server:
+        server.shutdown()
+        server.server_close()
+        QuietHandler.cache_store.client.disconnect_all()
+    if memcached:
+        memcached.stop()
@@ -0,0 +1,147 @@
+import bisect
+import threading
+from collections import defaultdict
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, _escape(value))
+                             for name, value in pairs)
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+class Counter(object):
+    """Monotonic counter, label values are passed positionally to inc."""
+    kind = 'counter'
+
+    def __init__(self, name, description, label_names=()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, **kwargs):
+        with self._lock:
+            self.values[labels] += kwargs.get('amount', 1)
+
+    def get(self, *labels):
+        return self.values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self.values.items())
+        for labels, value in values:
+            yield self.name, _format_labels(self.label_names, labels), value
+
+
+class Histogram(object):
+    """Histogram with fixed buckets, keeps per bucket counts, sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name, description, label_names=(),
+                 buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = {}
+        self.sums = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self.counts.get(labels)
+            if counts is None:
+                counts = self.counts[labels] = [0] * (len(self.buckets) + 1)
+            counts[bucket] += 1
+            self.sums[labels] += value
+
+    def count(self, *labels):
+        return sum(self.counts.get(labels, []))
+
+    def samples(self):
+        bounds = self.buckets + (float('inf'),)
+        with self._lock:
+            counts_by_labels = sorted((labels, list(counts)) for labels, counts
+                                      in self.counts.items())
+            sums = dict(self.sums)
+        for labels, counts in counts_by_labels:
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       _format_labels(self.label_names, labels,
+                                      [('le', _format_number(bound))]),
+                       cumulative)
+            formatted = _format_labels(self.label_names, labels)
+            yield self.name + '_sum', formatted, sums[labels]
+            yield self.name + '_count', formatted, cumulative
+
+
+class Registry(object):
+
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name, description, label_names=()):
+        metric = Counter(name, description, label_names)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, description, label_names=(),
+                  buckets=DEFAULT_BUCKETS):
+        metric = Histogram(name, description, label_names, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Renders all metrics in the prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.description))
+            lines.append('# TYPE %s %s' % (metric.name, metric.kind))
+            for name, labels, value in metric.samples():
+                lines.append('%s%s %s' % (name, labels,
+                                          _format_number(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter(
+    'scoring_requests_total', 'Handled requests by method and response code.',
+    ['method', 'code'])
+REQUEST_LATENCY = REGISTRY.histogram(
+    'scoring_request_duration_seconds', 'Request handling latency.',
+    ['method'])
+STORE_HITS = REGISTRY.counter(
+    'store_hits_total', 'Store lookups that found a value.', ['operation'])
+STORE_MISSES = REGISTRY.counter(
+    'store_misses_total', 'Store lookups that found no value.', ['operation'])
+STORE_ERRORS = REGISTRY.counter(
+    'store_errors_total', 'Store calls that failed after all retries.',
+    ['operation'])
+STORE_RETRIES = REGISTRY.counter(
+    'store_retries_total', 'Retried store calls.', ['operation'])
+LOCAL_COPIES = REGISTRY.counter(
+    'store_local_copy_total',
+    'Store reads served locally: fresh and stale copies and keys known '
+    'to be missing.', ['result'])
@@ -1,20 +1,77 @@
 import hashlib
 import json
+import time
 
+from store import SingleFlight
 
-def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
-              last_name=None):
+SCORE_CACHE_SECONDS = 60 * 60
+# memcached lock that lets one server process compute a missing score
+SCORE_LOCK_SECONDS = 5
+SCORE_LOCK_WAIT_SECONDS = 0.5
+SCORE_LOCK_POLL_SECONDS = 0.02
+
+_score_flight = SingleFlight()
+
+
+def get_score_key(first_name, last_name, birthday):
     key_parts = [
         first_name or "",
         last_name or "",
         birthday.strftime("%Y%m%d"),
     ]
-    key = "uid:" + hashlib.md5("".join(key_parts)).hexdigest()
+    return "uid:" + hashlib.md5("".join(key_parts)).hexdigest()
+
+
+def get_interests_key(cid):
+    return "i:%s" % cid
+
+
+def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
+              last_name=None):
+    key = get_score_key(first_name, last_name, birthday)
     # try get from cache,
     # fallback to heavy calculation in case of cache miss
     score = store.cache_get(key) or 0
     if score:
         return score
+    # concurrent misses of the same key in this process share one calculation
+    return _score_flight.do(key, _calculate_and_cache_score, store, key,
+                            phone, email, birthday, gender, first_name,
+                            last_name)
+
+
+def _wait_for_score(store, key):
+    deadline = time.time() + SCORE_LOCK_WAIT_SECONDS
+    while time.time() < deadline:
+        score = store.cache_peek(key)
+        if score:
+            return score
+        time.sleep(SCORE_LOCK_POLL_SECONDS)
+    return None
+
+
+def _calculate_and_cache_score(store, key, phone, email, birthday, gender,
+                               first_name, last_name):
+    lock_key = "lock:" + key
+    is_locked = store.cache_add(lock_key, 1, SCORE_LOCK_SECONDS)
+    if not is_locked and store.cache_peek(lock_key) is not None:
+        # another process is calculating this score, wait for its result
+        # and calculate it here only if it doesn't show up in time
+        score = _wait_for_score(store, key)
+        if score:
+            return score
+    try:
+        score = _calculate_score(phone, email, birthday, gender, first_name,
+                                 last_name)
+        store.cache_set(key, score, SCORE_CACHE_SECONDS)
+    finally:
+        if is_locked:
+            store.cache_delete(lock_key)
+    return score
+
+
+def _calculate_score(phone, email, birthday, gender, first_name, last_name):
+    score = 0
     if phone:
         score += 1.5
     if email:
@@ -23,11 +80,9 @@ def get_score(store, phone, email, birthday=None, gender=None, first_name=None,
         score += 1.5
     if first_name and last_name:
         score += 0.5
-    # cache for 60 minutes
-    store.cache_set(key, score, 60 * 60)
     return score
 
 
 def get_interests(store, cid):
-    r = store.get("i:%s" % cid)
+    r = store.get(get_interests_key(cid))
     return json.loads(r) if r else []
@@ -1,13 +1,30 @@
 from memcache import Client
+from collections import OrderedDict
 from functools import wraps
 import logging
+import Queue
+import threading
 import time
 import os
 
+import metrics
+
 MEMCACHED_PORT_ENV = 'MEMCACHED_11211_TCP'
 DEFAULT_PORT = 11211
 RETRY_COUNT = 5
 STORE_POLLING_TIMEOUT_SECONDS = 2
+LOCAL_COPY_REFRESH_SECONDS = 60
+LOCAL_COPY_MAX_STALE_SECONDS = 600
+# a failed get goes through RETRY_COUNT attempts spaced by
+# STORE_POLLING_TIMEOUT_SECONDS, keys the store confirmed missing are
+# remembered for several such cycles so that requests for them don't keep
+# waiting on the retries
+NEGATIVE_CACHE_SECONDS = 6 * RETRY_COUNT * STORE_POLLING_TIMEOUT_SECONDS
+# while the store is unreachable keys are failed only for a poll timeout, so
+# reads recover soon after it is back
+UNAVAILABLE_CACHE_SECONDS = STORE_POLLING_TIMEOUT_SECONDS
+LOCAL_COPY_MAX_ITEMS = 10000
+LOCAL_COPY_REFRESH_THREADS = 4
 
 
 def is_not_none(x):
@@ -18,7 +35,7 @@ def is_not_zero(x):
     return x != 0
 
 
-def retrying(success_condition, attempts, poll_timeout):
+def retrying(success_condition, attempts, poll_timeout, on_retry=None):
     def decorator(f):
         @wraps(f)
         def retry(*args, **kwargs):
@@ -41,6 +58,8 @@ def retrying(success_condition, attempts, poll_timeout):
                     logging.debug('Got unexpected result: %s retrying '
                                   'in %d s', str(result), poll_timeout)
                 _attempts -= 1
+                if on_retry:
+                    on_retry()
                 time.sleep(poll_timeout)
             return f(*args, **kwargs)
         return retry
@@ -51,45 +70,326 @@ class StoreError(Exception):
     pass
 
 
+class StoreUnavailableError(StoreError):
+    """The store couldn't be reached, so the key isn't known to be missing."""
+
+
+class _Call(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls with the same key into one invocation.
+
+    The first caller runs the function, callers arriving while it is running
+    wait for it and get the same result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, f, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = self._calls[key] = _Call()
+        if not is_leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = f(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
 class Store(object):
 
     def __init__(self, attempts=RETRY_COUNT,
-                 poll_timeout=STORE_POLLING_TIMEOUT_SECONDS):
-        memcached_port = os.environ.get(MEMCACHED_PORT_ENV, DEFAULT_PORT)
+                 poll_timeout=STORE_POLLING_TIMEOUT_SECONDS, port=None):
+        memcached_port = port or os.environ.get(MEMCACHED_PORT_ENV,
+                                                DEFAULT_PORT)
         self.client = Client(['localhost:%d' % int(memcached_port)])
         self.attempts = attempts
         self.poll_timeout = poll_timeout
 
     def _get(self, key):
-        @retrying(is_not_none, self.attempts, self.poll_timeout)
+        @retrying(is_not_none, self.attempts, self.poll_timeout,
+                  on_retry=lambda: metrics.STORE_RETRIES.inc('get'))
         def get_with_retry():
             return self.client.get(key)
-        return get_with_retry()
+        result = get_with_retry()
+        if result is None:
+            metrics.STORE_MISSES.inc('get')
+        else:
+            metrics.STORE_HITS.inc('get')
+        return result
 
     def _set(self, key, score, timeout):
-        @retrying(is_not_zero, self.attempts, self.poll_timeout)
+        @retrying(is_not_zero, self.attempts, self.poll_timeout,
+                  on_retry=lambda: metrics.STORE_RETRIES.inc('set'))
         def set_with_retry():
             return self.client.set(key, score, timeout)
         return set_with_retry()
 
+    def _get_multi(self, keys):
+        @retrying(is_not_none, self.attempts, self.poll_timeout,
+                  on_retry=lambda: metrics.STORE_RETRIES.inc('get_multi'))
+        def get_multi_with_retry():
+            return self.client.get_multi(keys)
+        result = get_multi_with_retry() or {}
+        metrics.STORE_HITS.inc('get_multi', amount=len(result))
+        metrics.STORE_MISSES.inc('get_multi', amount=len(keys) - len(result))
+        return result
+
     def cache_set(self, key, score, timeout):
         try:
             self._set(key, score, timeout)
         except Exception:
+            metrics.STORE_ERRORS.inc('set')
             logging.exception("Couldn't set value to cache.")
 
     def cache_get(self, key):
         try:
             return self._get(key)
         except Exception:
+            metrics.STORE_ERRORS.inc('get')
             logging.exception("Couldn't retrieve value from cache.")
 
+    def cache_add(self, key, value, timeout):
+        """Stores value only if key is absent, made once without retries."""
+        try:
+            return bool(self.client.add(key, value, timeout))
+        except Exception:
+            metrics.STORE_ERRORS.inc('add')
+            logging.exception("Couldn't add value to cache.")
+            return False
+
+    def cache_peek(self, key):
+        """Single cache lookup without retries, for polling."""
+        try:
+            return self.client.get(key)
+        except Exception:
+            metrics.STORE_ERRORS.inc('get')
+            logging.exception("Couldn't retrieve value from cache.")
+
+    def cache_delete(self, key):
+        try:
+            self.client.delete(key)
+        except Exception:
+            metrics.STORE_ERRORS.inc('delete')
+            logging.exception("Couldn't delete value from cache.")
+
+    def cache_get_multi(self, keys):
+        try:
+            return self._get_multi(keys)
+        except Exception:
+            metrics.STORE_ERRORS.inc('get_multi')
+            logging.exception("Couldn't retrieve values from cache.")
+            return {}
+
     def get(self, key):
-        result = None
         try:
             result = self._get(key)
         except Exception as e:
+            metrics.STORE_ERRORS.inc('get')
             logging.exception(e)
+            raise StoreUnavailableError("Couldn't retrieve object from "
+                                        "store.")
         if not result:
+            if not self.is_available():
+                raise StoreUnavailableError("Store is unavailable.")
             raise StoreError("Couldn't retrieve object from store.")
         return result
+
+    def is_available(self):
+        """Whether any memcached server answers, the client reports
+        unreachable servers as missing keys."""
+        try:
+            return bool(self.client.get_stats())
+        except Exception:
+            return False
+
+
+class PrefetchedStore(object):
+    """Store facade that serves values fetched beforehand with one multi-get.
+
+    Keys that were prefetched but are absent from the cache are reported as
+    cache misses right away, persistent store lookups of such keys and all
+    writes are delegated to the wrapped store.
+    """
+
+    def __init__(self, store, keys):
+        self.store = store
+        self.keys = set(keys)
+        self.values = store.cache_get_multi(list(self.keys)) if keys else {}
+
+    def cache_set(self, key, score, timeout):
+        self.values[key] = score
+        return self.store.cache_set(key, score, timeout)
+
+    def cache_get(self, key):
+        if key in self.values:
+            return self.values[key]
+        if key in self.keys:
+            return None
+        return self.store.cache_get(key)
+
+    def cache_add(self, key, value, timeout):
+        return self.store.cache_add(key, value, timeout)
+
+    def cache_peek(self, key):
+        return self.store.cache_peek(key)
+
+    def cache_delete(self, key):
+        return self.store.cache_delete(key)
+
+    def get(self, key):
+        result = self.values.get(key)
+        if result:
+            return result
+        return self.store.get(key)
+
+
+class LocalCopyStore(object):
+    """Store facade keeping local copies of values read with get.
+
+    Copies younger than refresh_after seconds are served as they are, older
+    ones are served for up to max_stale seconds while being refreshed by one
+    of refresh_threads background threads. Keys the store confirmed missing
+    are remembered for negative_ttl seconds and fail right away instead of
+    going through another retry cycle, keys that couldn't be retrieved from
+    the unavailable store only for unavailable_ttl seconds. Other calls are
+    delegated to the wrapped store.
+    """
+
+    def __init__(self, store, refresh_after=LOCAL_COPY_REFRESH_SECONDS,
+                 max_stale=LOCAL_COPY_MAX_STALE_SECONDS,
+                 negative_ttl=NEGATIVE_CACHE_SECONDS,
+                 unavailable_ttl=UNAVAILABLE_CACHE_SECONDS,
+                 max_items=LOCAL_COPY_MAX_ITEMS,
+                 refresh_threads=LOCAL_COPY_REFRESH_THREADS):
+        self.store = store
+        self.refresh_after = refresh_after
+        self.max_stale = max_stale
+        self.negative_ttl = negative_ttl
+        self.unavailable_ttl = unavailable_ttl
+        self.max_items = max_items
+        self.refresh_threads = refresh_threads
+        self._lock = threading.Lock()
+        # key -> (value, fetched_at), in least recently used order
+        self._copies = OrderedDict()
+        # key -> time until which the key fails without a store lookup
+        self._missing = {}
+        # keys are queued once while in _refreshing, so the queue never holds
+        # more than one entry per stale copy
+        self._refreshing = set()
+        self._refresh_queue = Queue.Queue()
+        self._refresh_workers = []
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def cache_set(self, key, score, timeout):
+        self.forget(key)
+        return self.store.cache_set(key, score, timeout)
+
+    def forget(self, key):
+        with self._lock:
+            self._copies.pop(key, None)
+            self._missing.pop(key, None)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            copy = self._copies.pop(key, None)
+            if copy is not None and now - copy[1] < self.max_stale:
+                self._copies[key] = copy
+            else:
+                copy = None
+            missing_until = self._missing.get(key)
+        if copy is not None:
+            value, fetched_at = copy
+            if now - fetched_at < self.refresh_after:
+                metrics.LOCAL_COPIES.inc('fresh')
+            else:
+                metrics.LOCAL_COPIES.inc('stale')
+                self._refresh_in_background(key)
+            return value
+        if missing_until is not None and now < missing_until:
+            metrics.LOCAL_COPIES.inc('missing')
+            raise StoreError("Object recently couldn't be retrieved from "
+                             "store.")
+        try:
+            value = self.store.get(key)
+        except StoreUnavailableError:
+            self._remember_missing(key, now, self.unavailable_ttl)
+            raise
+        except StoreError:
+            self._remember_missing(key, now, self.negative_ttl)
+            raise
+        self._remember(key, value)
+        return value
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._missing.pop(key, None)
+            self._copies.pop(key, None)
+            self._copies[key] = (value, time.time())
+            while len(self._copies) > self.max_items:
+                self._copies.popitem(last=False)
+
+    def _remember_missing(self, key, now, ttl):
+        with self._lock:
+            if len(self._missing) >= self.max_items:
+                self._missing = dict(
+                    (k, until) for k, until in self._missing.items()
+                    if until > now)
+                if len(self._missing) >= self.max_items:
+                    self._missing.clear()
+            self._missing[key] = now + ttl
+
+    def _refresh_in_background(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+            if not self._refresh_workers:
+                self._start_refresh_workers()
+        self._refresh_queue.put(key)
+
+    def _start_refresh_workers(self):
+        for _ in range(self.refresh_threads):
+            thread = threading.Thread(target=self._refresh_forever)
+            thread.setDaemon(True)
+            thread.start()
+            self._refresh_workers.append(thread)
+
+    def _refresh_forever(self):
+        while True:
+            self._refresh(self._refresh_queue.get())
+
+    def _refresh(self, key):
+        try:
+            value = self.store.get(key)
+        except Exception:
+            logging.info("Couldn't refresh local copy of %s, the stale "
+                         "one is kept.", key)
+        else:
+            self._remember(key, value)
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
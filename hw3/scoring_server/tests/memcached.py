@@ -0,0 +1,24 @@
+import os
+
+from scoring_server import store
+from scoring_server.fake_memcached import FakeMemcached
+
+_fake_memcached = None
+
+
+def start_memcached():
+    """Starts the fake memcached unless a real one is provided by tox."""
+    global _fake_memcached
+    if store.MEMCACHED_PORT_ENV in os.environ:
+        return
+    _fake_memcached = FakeMemcached().start()
+    os.environ[store.MEMCACHED_PORT_ENV] = str(_fake_memcached.port)
+
+
+def stop_memcached():
+    global _fake_memcached
+    if _fake_memcached is None:
+        return
+    _fake_memcached.stop()
+    _fake_memcached = None
+    os.environ.pop(store.MEMCACHED_PORT_ENV, None)
@@ -3,7 +3,7 @@
 
 import unittest
 import parameterized
-from mock import MagicMock
+from mock import MagicMock, patch
 import copy
 
 from . import test_constants
@@ -121,6 +121,112 @@ class ApiTests(unittest.TestCase):
             self.get_response(request)
 
 
+class BatchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.context = {}
+        self.headers = {}
+        self.store_stub = MagicMock(store.Store)
+        self.store_stub.cache_get.side_effect = lambda x: None
+        self.store_stub.cache_set.side_effect = lambda x, y, z: None
+        self.store_stub.get.side_effect = lambda x: None
+        self.store_stub.cache_get_multi.side_effect = lambda keys: {
+            'i:1': '["travel", "geek"]', 'i:2': '["sport", "cars"]'}
+
+    def get_response(self, requests):
+        return api.batch_method_handler(
+            {"body": requests, "headers": self.headers}, self.context,
+            self.store_stub)
+
+    def test_body_is_not_a_list(self):
+        with self.assertRaisesRegexp(ValueError, 'must be a list'):
+            self.get_response(test_constants.VALID_SCORE_REQUEST.copy())
+
+    def test_batch_is_too_large(self):
+        requests = [test_constants.VALID_SCORE_REQUEST.copy()] * (
+            api.MAX_BATCH_SIZE + 1)
+        with self.assertRaisesRegexp(ValueError, 'at most'):
+            self.get_response(requests)
+
+    def test_mixed_batch(self):
+        invalid_token = test_constants.VALID_SCORE_REQUEST.copy()
+        invalid_token['token'] = 'invalid_token'
+        unknown_method = test_constants.VALID_SCORE_REQUEST.copy()
+        unknown_method['method'] = 'unknown'
+        requests = [
+            test_constants.VALID_SCORE_REQUEST.copy(),
+            test_constants.VALID_INTERESTS_REQUEST.copy(),
+            invalid_token,
+            unknown_method,
+            {'login': 'login'},
+        ]
+        response, code = self.get_response(requests)
+        self.assertEqual(code, api.OK)
+        self.assertEqual([r['code'] for r in response],
+                         [api.OK, api.OK, api.FORBIDDEN,
+                          api.INVALID_REQUEST, api.INVALID_REQUEST])
+        self.assertDictEqual(response[0]['response'], {'score': 5.0})
+        self.assertDictEqual(response[1]['response'],
+                             {1: ['travel', 'geek'], 2: ['sport', 'cars'],
+                              3: [], 4: []})
+
+    def test_store_is_queried_with_one_multi_get(self):
+        requests = [test_constants.VALID_SCORE_REQUEST.copy(),
+                    test_constants.VALID_INTERESTS_REQUEST.copy()]
+        self.get_response(requests)
+        self.assertEqual(self.store_stub.cache_get_multi.call_count, 1)
+        keys = self.store_stub.cache_get_multi.call_args[0][0]
+        self.assertEqual(len(keys), 5)
+        self.assertFalse(self.store_stub.cache_get.called)
+        self.assertEqual(
+            sorted(c[0][0] for c in self.store_stub.get.call_args_list),
+            ['i:3', 'i:4'])
+
+
+class AuthCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.cache = api.AuthCache(max_size=2)
+
+    def test_user_token_is_hashed_once(self):
+        with patch.object(api.hashlib, 'sha512',
+                          wraps=api.hashlib.sha512) as sha512:
+            for _ in range(3):
+                self.assertTrue(self.cache.check_user(
+                    u'account1', u'login', test_constants.VALID_TOKEN))
+        self.assertEqual(sha512.call_count, 1)
+
+    def test_invalid_user_token_is_not_cached(self):
+        for _ in range(2):
+            self.assertFalse(self.cache.check_user(
+                u'account1', u'login', u'invalid_token'))
+        self.assertFalse(self.cache._verified)
+
+    def test_cache_size_is_bounded(self):
+        for login in ['a', 'b', 'c']:
+            token = api.hashlib.sha512(
+                'account' + login + api.SALT).hexdigest()
+            self.assertTrue(self.cache.check_user('account', login, token))
+        self.assertLessEqual(len(self.cache._verified), 2)
+
+    def test_admin_digest_is_computed_once_per_hour(self):
+        token = test_constants.generate_admin_token()
+        with patch.object(api.hashlib, 'sha512',
+                          wraps=api.hashlib.sha512) as sha512:
+            self.assertTrue(self.cache.check_admin(token))
+            self.assertTrue(self.cache.check_admin(unicode(token)))
+            self.assertFalse(self.cache.check_admin(u'invalid_token'))
+        self.assertEqual(sha512.call_count, 1)
+
+    def test_admin_digest_expires(self):
+        self.cache.admin_digest()
+        self.cache._admin_digest_expires_at = 0
+        with patch.object(api.hashlib, 'sha512',
+                          wraps=api.hashlib.sha512) as sha512:
+            self.cache.admin_digest()
+        self.assertEqual(sha512.call_count, 1)
+
+
 class FieldsTests(unittest.TestCase):
 
     @parameterized.parameterized.expand([
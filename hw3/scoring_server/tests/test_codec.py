@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import unittest
+from mock import patch
+
+from scoring_server import api
+from scoring_server import codec
+
+
+class HandlerStub(api.MainHTTPHandler):
+
+    def __init__(self):
+        self.path = '/method/'
+
+
+class CodecTests(unittest.TestCase):
+
+    def test_stdlib_codec_is_default(self):
+        self.assertEqual(codec.get_codec().name, codec.DEFAULT_CODEC)
+        self.assertEqual(api.MainHTTPHandler.json_codec.name,
+                         codec.DEFAULT_CODEC)
+
+    def test_auto_codec_is_available(self):
+        auto_codec = codec.get_codec(codec.AUTO_CODEC)
+        self.assertIn(auto_codec.name, codec.PREFERRED_CODECS)
+        self.assertEqual(auto_codec.loads(auto_codec.dumps({'a': [1]})),
+                         {'a': [1]})
+
+    def test_unknown_codec(self):
+        with self.assertRaisesRegexp(ValueError, 'Unknown or not installed'):
+            codec.get_codec('unknown')
+
+
+class BodyLoggingTests(unittest.TestCase):
+
+    def setUp(self):
+        self.handler = HandlerStub()
+        self.context = {'request_id': 'id'}
+        self.log_level = logging.getLogger().level
+        logging.getLogger().setLevel(logging.INFO)
+
+    def tearDown(self):
+        logging.getLogger().setLevel(self.log_level)
+
+    @patch.object(api.logging, 'info')
+    def test_body_is_logged_by_default(self, info):
+        self.handler.log_request_body('{}', self.context)
+        info.assert_called_once_with('%s: %s %s', '/method/', '{}', 'id')
+
+    @patch.object(api.logging, 'info')
+    def test_body_is_not_logged_below_info_level(self, info):
+        logging.getLogger().setLevel(logging.WARNING)
+        self.handler.log_request_body('{}', self.context)
+        self.assertFalse(info.called)
+
+    @patch.object(api.logging, 'info')
+    def test_body_logging_is_disabled(self, info):
+        self.handler.body_log_rate = 0
+        self.handler.log_request_body('{}', self.context)
+        self.assertFalse(info.called)
+
+    @patch.object(api.random, 'random')
+    @patch.object(api.logging, 'info')
+    def test_body_logging_is_sampled(self, info, random):
+        self.handler.body_log_rate = 0.1
+        random.side_effect = [0.5, 0.05]
+        self.handler.log_request_body('{}', self.context)
+        self.handler.log_request_body('{}', self.context)
+        self.assertEqual(info.call_count, 1)
+
+    @patch.object(api.logging, 'info')
+    def test_response_is_logged_by_default(self, info):
+        self.context['response'] = {'score': 5.0}
+        self.handler.log_response(200, self.context)
+        info.assert_called_once_with(self.context)
+
+    @patch.object(api.random, 'random')
+    @patch.object(api.logging, 'info')
+    def test_response_logging_is_sampled(self, info, random):
+        self.handler.body_log_rate = 0.1
+        random.side_effect = [0.5, 0.05]
+        self.context['response'] = {'score': 5.0}
+        self.handler.log_response(200, self.context)
+        self.handler.log_response(200, self.context)
+        self.assertEqual(info.call_args_list, [
+            (('%s: %s', 'id', 200),), ((self.context,),)])
+
+
+if __name__ == "__main__":
+    unittest.main()
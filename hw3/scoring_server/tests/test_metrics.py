@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+from mock import MagicMock
+
+from scoring_server import api
+from scoring_server import metrics
+from scoring_server import store
+
+
+class MetricsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter_render(self):
+        counter = self.registry.counter('requests_total', 'Requests.',
+                                        ['method', 'code'])
+        counter.inc('online_score', 200)
+        counter.inc('online_score', 200)
+        counter.inc('clients_interests', 422, amount=3)
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP requests_total Requests.',
+            '# TYPE requests_total counter',
+            'requests_total{method="clients_interests",code="422"} 3.0',
+            'requests_total{method="online_score",code="200"} 2.0',
+        ]) + '\n')
+
+    def test_histogram_render(self):
+        histogram = self.registry.histogram('latency', 'Latency.',
+                                            ['method'], buckets=[0.1, 1])
+        histogram.observe(0.05, 'batch')
+        histogram.observe(0.1, 'batch')
+        histogram.observe(5, 'batch')
+        self.assertEqual(histogram.count('batch'), 3)
+        self.assertEqual(self.registry.render(), '\n'.join([
+            '# HELP latency Latency.',
+            '# TYPE latency histogram',
+            'latency_bucket{method="batch",le="0.1"} 2.0',
+            'latency_bucket{method="batch",le="1.0"} 2.0',
+            'latency_bucket{method="batch",le="+Inf"} 3.0',
+            'latency_sum{method="batch"} 5.15',
+            'latency_count{method="batch"} 3.0',
+        ]) + '\n')
+
+    def test_label_values_are_escaped(self):
+        counter = self.registry.counter('c', 'C.', ['label'])
+        counter.inc('a"b\\c')
+        self.assertIn('c{label="a\\"b\\\\c"} 1.0', self.registry.render())
+
+    def test_metrics_method_label(self):
+        self.assertEqual(api._metrics_method('method', {'method': 'x'}),
+                         api.UNKNOWN_METRICS_METHOD)
+        self.assertEqual(
+            api._metrics_method('method', {'method': 'online_score'}),
+            'online_score')
+        self.assertEqual(api._metrics_method('method/batch', []),
+                         api.BATCH_METRICS_METHOD)
+
+
+class StoreMetricsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.store = store.Store(attempts=3, poll_timeout=0)
+        self.store.client = MagicMock()
+
+    def test_hits_and_misses_are_counted(self):
+        hits = metrics.STORE_HITS.get('get')
+        misses = metrics.STORE_MISSES.get('get')
+        self.store.client.get.side_effect = lambda key: 1
+        self.store.cache_get('key')
+        self.store.client.get.side_effect = lambda key: None
+        self.store.cache_get('key')
+        self.assertEqual(metrics.STORE_HITS.get('get'), hits + 1)
+        self.assertEqual(metrics.STORE_MISSES.get('get'), misses + 1)
+
+    def test_retries_and_errors_are_counted(self):
+        retries = metrics.STORE_RETRIES.get('get')
+        errors = metrics.STORE_ERRORS.get('get')
+        self.store.client.get.side_effect = IOError('connection refused')
+        self.assertIsNone(self.store.cache_get('key'))
+        self.assertEqual(metrics.STORE_RETRIES.get('get'), retries + 2)
+        self.assertEqual(metrics.STORE_ERRORS.get('get'), errors + 1)
+
+    def test_multi_get_is_counted(self):
+        hits = metrics.STORE_HITS.get('get_multi')
+        misses = metrics.STORE_MISSES.get('get_multi')
+        self.store.client.get_multi.side_effect = lambda keys: {'a': 1}
+        self.assertEqual(self.store.cache_get_multi(['a', 'b', 'c']),
+                         {'a': 1})
+        self.assertEqual(metrics.STORE_HITS.get('get_multi'), hits + 1)
+        self.assertEqual(metrics.STORE_MISSES.get('get_multi'), misses + 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import threading
+import time
+import unittest
+from mock import MagicMock
+
+from scoring_server import scoring
+from scoring_server import store
+
+BIRTHDAY = datetime.datetime(1990, 1, 1)
+SCORE_KEY = scoring.get_score_key('Egor', 'Borisov', BIRTHDAY)
+LOCK_KEY = 'lock:' + SCORE_KEY
+
+
+class SingleFlightTests(unittest.TestCase):
+
+    def setUp(self):
+        self.flight = store.SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.calls = []
+
+    def slow_call(self, value):
+        self.calls.append(value)
+        self.started.set()
+        self.release.wait()
+        if isinstance(value, Exception):
+            raise value
+        return value
+
+    def run_concurrently(self, value, count=5):
+        results = []
+
+        def target():
+            try:
+                results.append(self.flight.do('key', self.slow_call, value))
+            except Exception as e:
+                results.append(e)
+
+        leader = threading.Thread(target=target)
+        leader.start()
+        self.started.wait()
+        call = self.flight._calls['key']
+        waiting = []
+        wait = call.done.wait
+
+        def counting_wait(*args):
+            waiting.append(True)
+            return wait(*args)
+
+        call.done.wait = counting_wait
+        followers = [threading.Thread(target=target)
+                     for _ in range(count - 1)]
+        for thread in followers:
+            thread.start()
+        while len(waiting) < len(followers):
+            time.sleep(0.001)
+        self.release.set()
+        for thread in [leader] + followers:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_are_coalesced(self):
+        results = self.run_concurrently(4.5)
+        self.assertEqual(results, [4.5] * 5)
+        self.assertEqual(self.calls, [4.5])
+        self.assertFalse(self.flight._calls)
+
+    def test_error_is_shared(self):
+        error = ValueError('failed')
+        results = self.run_concurrently(error, count=2)
+        self.assertEqual(results, [error, error])
+        self.assertEqual(self.calls, [error])
+        self.assertFalse(self.flight._calls)
+
+    def test_sequential_calls_are_not_coalesced(self):
+        self.release.set()
+        self.flight.do('key', self.slow_call, 1)
+        self.flight.do('key', self.slow_call, 2)
+        self.assertEqual(self.calls, [1, 2])
+
+
+class ScoreLockTests(unittest.TestCase):
+
+    def setUp(self):
+        self.store_stub = MagicMock(store.Store)
+        self.store_stub.cache_get.side_effect = lambda key: None
+
+    def get_score(self):
+        return scoring.get_score(self.store_stub, '71234567890', None,
+                                 BIRTHDAY, 1, 'Egor', 'Borisov')
+
+    def test_score_is_calculated_under_lock(self):
+        self.store_stub.cache_add.side_effect = lambda key, value, t: True
+        self.assertEqual(self.get_score(), 3.5)
+        self.store_stub.cache_add.assert_called_once_with(
+            LOCK_KEY, 1, scoring.SCORE_LOCK_SECONDS)
+        self.store_stub.cache_set.assert_called_once_with(
+            SCORE_KEY, 3.5, scoring.SCORE_CACHE_SECONDS)
+        self.store_stub.cache_delete.assert_called_once_with(LOCK_KEY)
+
+    def test_score_of_lock_owner_is_used(self):
+        self.store_stub.cache_add.side_effect = lambda key, value, t: False
+        self.store_stub.cache_peek.side_effect = [1, None, 5.0]
+        self.assertEqual(self.get_score(), 5.0)
+        self.assertFalse(self.store_stub.cache_set.called)
+        self.assertFalse(self.store_stub.cache_delete.called)
+
+    def test_score_is_calculated_when_store_is_unavailable(self):
+        self.store_stub.cache_add.side_effect = lambda key, value, t: False
+        self.store_stub.cache_peek.side_effect = lambda key: None
+        self.assertEqual(self.get_score(), 3.5)
+        self.store_stub.cache_peek.assert_called_once_with(LOCK_KEY)
+        self.assertFalse(self.store_stub.cache_delete.called)
+
+
+if __name__ == "__main__":
+    unittest.main()
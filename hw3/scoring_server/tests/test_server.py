@@ -1,10 +1,10 @@
 from .. import api, store
 from threading import Thread
-from BaseHTTPServer import HTTPServer
 import unittest
 import socket
 import requests
 import test_constants
+from memcached import start_memcached, stop_memcached
 
 
 def get_free_port():
@@ -15,17 +15,29 @@ def get_free_port():
     return port
 
 
+def setUpModule():
+    start_memcached()
+
+
+def tearDownModule():
+    stop_memcached()
+
+
 class MainHandlerTest(unittest.TestCase):
 
     def setUp(self):
         self.port = get_free_port()
         self.handler_url = 'http://localhost:%d/method/' % self.port
-        self.server = HTTPServer(('localhost', self.port),
-                                 api.MainHTTPHandler)
+        self.server = api.ThreadingHTTPServer(('localhost', self.port),
+                                              api.MainHTTPHandler)
         self.server_thread = Thread(target=self.server.serve_forever)
         self.server_thread.setDaemon(True)
         self.server_thread.start()
-        self.cache_store = store.Store()
+        # the store the server runs with, without copies kept across tests
+        self.cache_store = store.LocalCopyStore(
+            store.Store(), refresh_after=0, negative_ttl=0, unavailable_ttl=0)
+        self.handler_cache_store = api.MainHTTPHandler.cache_store
+        api.MainHTTPHandler.cache_store = self.cache_store
 
     def test_score_request(self):
         response = requests.post(self.handler_url,
@@ -51,5 +63,18 @@ class MainHandlerTest(unittest.TestCase):
              "3": {'i': ["books", "sport"]},
              "4": {'i': ["hi-tech", "cinema"]}})
 
+    def test_metrics(self):
+        requests.post(self.handler_url, json={'method': 'online_score'})
+        response = requests.get('http://localhost:%d/metrics' % self.port)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('scoring_requests_total{method="online_score",'
+                      'code="422"}', response.text)
+        self.assertIn('# TYPE scoring_request_duration_seconds histogram',
+                      response.text)
+
     def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
         self.cache_store.client.flush_all()
+        self.cache_store.client.disconnect_all()
+        api.MainHTTPHandler.cache_store = self.handler_cache_store
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+from mock import MagicMock
+
+from scoring_server import store
+
+
+class LocalCopyStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.values = {'i:1': '["travel", "geek"]'}
+        self.store_stub = MagicMock(store.Store)
+        self.store_stub.get.side_effect = self.get
+        self.local_store = store.LocalCopyStore(
+            self.store_stub, refresh_after=60, max_stale=600,
+            negative_ttl=10, unavailable_ttl=1, max_items=2)
+        self.available = True
+
+    def get(self, key):
+        if not self.available:
+            raise store.StoreUnavailableError("Store is unavailable.")
+        if key not in self.values:
+            raise store.StoreError("Couldn't retrieve object from store.")
+        return self.values[key]
+
+    def age_copy(self, key, seconds):
+        value, fetched_at = self.local_store._copies[key]
+        self.local_store._copies[key] = (value, fetched_at - seconds)
+
+    def wait_for_refresh(self):
+        while self.local_store._refreshing:
+            time.sleep(0.001)
+
+    def test_fresh_copy_is_served_locally(self):
+        self.assertEqual(self.local_store.get('i:1'), '["travel", "geek"]')
+        self.assertEqual(self.local_store.get('i:1'), '["travel", "geek"]')
+        self.assertEqual(self.store_stub.get.call_count, 1)
+
+    def test_stale_copy_is_served_while_refreshing(self):
+        self.local_store.get('i:1')
+        self.age_copy('i:1', 120)
+        self.values['i:1'] = '["books"]'
+        self.assertEqual(self.local_store.get('i:1'), '["travel", "geek"]')
+        self.wait_for_refresh()
+        self.assertEqual(self.local_store.get('i:1'), '["books"]')
+        self.assertEqual(self.store_stub.get.call_count, 2)
+
+    def test_stale_copy_is_kept_when_refresh_fails(self):
+        self.local_store.get('i:1')
+        self.age_copy('i:1', 120)
+        del self.values['i:1']
+        self.local_store.get('i:1')
+        self.wait_for_refresh()
+        self.assertEqual(self.local_store.get('i:1'), '["travel", "geek"]')
+
+    def test_stale_copies_are_refreshed_by_fixed_threads(self):
+        self.values['i:2'] = '[]'
+        for key in ['i:1', 'i:2']:
+            self.local_store.get(key)
+            self.age_copy(key, 120)
+        self.values.update({'i:1': '["books"]', 'i:2': '["cars"]'})
+        for _ in range(3):
+            for key in ['i:1', 'i:2']:
+                self.local_store.get(key)
+            self.wait_for_refresh()
+        self.assertEqual(len(self.local_store._refresh_workers),
+                         store.LOCAL_COPY_REFRESH_THREADS)
+        self.assertEqual(self.local_store.get('i:1'), '["books"]')
+        self.assertEqual(self.local_store.get('i:2'), '["cars"]')
+
+    def test_too_stale_copy_is_not_served(self):
+        self.local_store.get('i:1')
+        self.age_copy('i:1', 1200)
+        del self.values['i:1']
+        with self.assertRaises(store.StoreError):
+            self.local_store.get('i:1')
+
+    def test_missing_key_is_cached(self):
+        for _ in range(3):
+            with self.assertRaises(store.StoreError):
+                self.local_store.get('i:2')
+        self.assertEqual(self.store_stub.get.call_count, 1)
+
+    def test_key_is_cached_briefly_while_store_is_unavailable(self):
+        self.available = False
+        now = time.time()
+        for _ in range(3):
+            with self.assertRaises(store.StoreError):
+                self.local_store.get('i:1')
+        self.assertEqual(self.store_stub.get.call_count, 1)
+        self.assertLessEqual(self.local_store._missing['i:1'], now + 2)
+
+    def test_key_is_retrieved_after_store_is_back(self):
+        self.available = False
+        with self.assertRaises(store.StoreUnavailableError):
+            self.local_store.get('i:1')
+        self.local_store._missing['i:1'] = time.time() - 1
+        self.available = True
+        self.assertEqual(self.local_store.get('i:1'), '["travel", "geek"]')
+
+    def test_missing_key_expires(self):
+        with self.assertRaises(store.StoreError):
+            self.local_store.get('i:2')
+        self.local_store._missing['i:2'] = time.time() - 1
+        self.values['i:2'] = '["cars"]'
+        self.assertEqual(self.local_store.get('i:2'), '["cars"]')
+
+    def test_set_drops_local_copy(self):
+        with self.assertRaises(store.StoreError):
+            self.local_store.get('i:2')
+        self.local_store.cache_set('i:2', '["cars"]', 10)
+        self.store_stub.cache_set.assert_called_once_with('i:2', '["cars"]',
+                                                          10)
+        self.values['i:2'] = '["cars"]'
+        self.assertEqual(self.local_store.get('i:2'), '["cars"]')
+
+    def test_copies_are_bounded(self):
+        self.values.update({'i:2': '[]', 'i:3': '[]'})
+        for key in ['i:1', 'i:2', 'i:3']:
+            self.local_store.get(key)
+        self.assertEqual(list(self.local_store._copies), ['i:2', 'i:3'])
+
+    def test_other_calls_are_delegated(self):
+        self.local_store.cache_get('uid:1')
+        self.store_stub.cache_get.assert_called_once_with('uid:1')
+
+
+class StoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.store = store.Store(attempts=1, poll_timeout=0)
+        self.store.client = MagicMock()
+        self.store.client.get.return_value = None
+
+    def test_key_missing_from_answering_store(self):
+        self.store.client.get_stats.return_value = [('localhost:11211', {})]
+        with self.assertRaises(store.StoreError) as context:
+            self.store.get('i:1')
+        self.assertNotIsInstance(context.exception,
+                                 store.StoreUnavailableError)
+
+    def test_key_not_retrieved_from_unreachable_store(self):
+        self.store.client.get_stats.return_value = []
+        with self.assertRaises(store.StoreUnavailableError):
+            self.store.get('i:1')
+
+    def test_client_error_is_unavailable_store(self):
+        self.store.client.get.side_effect = IOError('Connection refused')
+        with self.assertRaises(store.StoreUnavailableError):
+            self.store.get('i:1')
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,6 +7,15 @@ import copy
 from scoring_server import api
 from scoring_server import store
 from . import test_constants
+from .memcached import start_memcached, stop_memcached
+
+
+def setUpModule():
+    start_memcached()
+
+
+def tearDownModule():
+    stop_memcached()
 
 
 class StoreIntegrationTest(unittest.TestCase):
@@ -33,13 +42,13 @@ class StoreIntegrationTest(unittest.TestCase):
         self.assertEqual(cached_score, 5.0)
 
     def test_caching_key_parameters_differ(self):
-        total_items_before = int(self.store.client.get_stats()[0][1]['total_items'])
+        total_items_before = int(self.store.client.get_stats()[0][1]['curr_items'])
         request1 = copy.deepcopy(test_constants.VALID_SCORE_REQUEST)
         _, _ = self.get_response(request1)
         request2 = copy.deepcopy(test_constants.VALID_SCORE_REQUEST)
         request2['arguments']['birthday'] = '01.01.1989'
         _, _ = self.get_response(request2)
-        total_items_after = int(self.store.client.get_stats()[0][1]['total_items'])
+        total_items_after = int(self.store.client.get_stats()[0][1]['curr_items'])
         self.assertEqual(total_items_after - total_items_before, 2)
 
     def test_interests_with_store(self):
@@ -62,4 +71,5 @@ class StoreIntegrationTest(unittest.TestCase):
             _, _ = self.get_response(request)
 
     def tearDown(self):
-        self.store.client.flush_all()
\ No newline at end of file
+        self.store.client.flush_all()
+        self.store.client.disconnect_all()
@@ -0,0 +1,158 @@
+import logging
+import queue
+import random
+import threading
+import time
+
+from logging.handlers import QueueHandler
+
+# nginx log_format combined
+COMBINED_FORMAT = ('%(remote_addr)s - - [%(time_local)s] "%(request)s" '
+                   '%(status)d %(body_bytes_sent)d "%(http_referer)s" '
+                   '"%(http_user_agent)s"')
+# nginx log_format ui read by the log analyzer, combined with request time
+UI_FORMAT = ('%(remote_addr)s -  - [%(time_local)s] "%(request)s" '
+             '%(status)d %(body_bytes_sent)d "%(http_referer)s" '
+             '"%(http_user_agent)s" "-" "-" "-" %(request_time).3f')
+LOG_FORMATS = {'combined': COMBINED_FORMAT, 'ui': UI_FORMAT}
+TIME_LOCAL_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+BATCH_SIZE = 512
+FLUSH_INTERVAL_SECONDS = 0.5
+MAX_QUEUE_SIZE = 16 * 1024
+_STOP = object()
+
+
+def _escape(value):
+    """Escapes quotes, backslashes and non printable characters as nginx
+    does in the access log."""
+    if value.isprintable() and '"' not in value and '\\' not in value:
+        return value
+    return ''.join(char if char.isprintable() and char not in '"\\'
+                   else ''.join(f'\\x{byte:02X}' for byte in char.encode())
+                   for char in value)
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """Hands records to the writer thread as they are, never blocks."""
+
+    def __init__(self, records_queue):
+        super().__init__(records_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # formatting is left to the writer thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class AccessLog(object):
+    """Access log of a worker written in batches by a background thread.
+
+    Entries are put to a bounded queue through a QueueHandler, the event
+    loop only creates a log record, the writer thread formats records and
+    appends every batch to the file with a single write. When the writer
+    falls behind entries are dropped instead of blocking requests.
+    sample_rate controls the share of logged requests, server errors are
+    always logged.
+    """
+
+    def __init__(self, path, log_format='combined', sample_rate=1.0,
+                 batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL_SECONDS,
+                 max_queue_size=MAX_QUEUE_SIZE):
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f'Unknown access log format {log_format}')
+        self.path = path
+        self.log_format = LOG_FORMATS[log_format]
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue_size = max_queue_size
+        self._logger = None
+        self._handler = None
+        self._thread = None
+        self._time_cache = (None, None)
+
+    def start(self):
+        """Starts the writer thread, must be called in the worker process."""
+        records_queue = queue.Queue(self.max_queue_size)
+        self._handler = _DroppingQueueHandler(records_queue)
+        # a logger of its own, so access entries don't reach the error log
+        self._logger = logging.Logger('httpd.access', logging.INFO)
+        self._logger.addHandler(self._handler)
+        self._thread = threading.Thread(
+            target=self._write_batches, args=(records_queue,),
+            name='access-log-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Writes out queued entries and stops the writer thread."""
+        if self._thread is None:
+            return
+        self._handler.queue.put(_STOP)
+        self._thread.join()
+        if self._handler.dropped:
+            logging.warning('%d access log entries were dropped.',
+                            self._handler.dropped)
+        self._logger = self._handler = self._thread = None
+
+    def log(self, remote_addr, request, status, body_bytes_sent,
+            http_referer, http_user_agent, request_time):
+        if self._logger is None:
+            return
+        # server errors are never sampled out
+        sampled = self.sample_rate < 1 and status < 500
+        if sampled and random.random() >= self.sample_rate:
+            return
+        self._logger.info(self.log_format, {
+            'remote_addr': remote_addr,
+            'request': request,
+            'status': status,
+            'body_bytes_sent': body_bytes_sent,
+            'http_referer': http_referer,
+            'http_user_agent': http_user_agent,
+            'request_time': request_time,
+        })
+
+    def _time_local(self, created):
+        second = int(created)
+        cached_second, formatted = self._time_cache
+        if second != cached_second:
+            formatted = time.strftime(TIME_LOCAL_FORMAT,
+                                      time.localtime(second))
+            self._time_cache = second, formatted
+        return formatted
+
+    def _format(self, record):
+        fields = dict(record.args, time_local=self._time_local(record.created))
+        for name in ('request', 'http_referer', 'http_user_agent'):
+            fields[name] = _escape(fields[name])
+        return record.msg % fields + '\n'
+
+    def _write_batches(self, records_queue):
+        with open(self.path, 'ab', buffering=0) as file:
+            stopped = False
+            while not stopped:
+                batch = [records_queue.get()]
+                deadline = time.monotonic() + self.flush_interval
+                while batch[-1] is not _STOP and len(batch) < self.batch_size:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(records_queue.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+                if batch[-1] is _STOP:
+                    stopped = True
+                    batch.pop()
+                if batch:
+                    data = ''.join(self._format(record) for record in batch)
+                    try:
+                        file.write(data.encode('utf-8'))
+                    except OSError:
+                        logging.exception('Error on writing access log.')
@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark and regression suite of the server.
+
+Starts the server on a generated document root for every combination of
+worker count, socket mode, keep-alive and requested file, loads it from
+concurrent asyncio clients and reports RPS, latency percentiles, CPU usage
+and the number of connections accepted by every worker. Results can be saved
+as JSON and compared with the results of another run, e.g. of a previous
+commit.
+"""
+import asyncio
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import tempfile
+import time
+
+from optparse import OptionParser
+
+from httpd import DIYHTTPServer
+
+# name -> (file name, size)
+FILES = {
+    'small': ('small.html', 1024),
+    'large': ('large.bin', 1024 * 1024),
+}
+MODES = {'shared': False, 'reuseport': True}
+KEEP_ALIVE_MODES = {'on': True, 'off': False}
+SERVER_START_TIMEOUT_SECONDS = 5
+RESPONSE_HEAD_ENDING = b'\r\n\r\n'
+
+
+class BenchmarkServer(DIYHTTPServer):
+    """Server recording pids of its workers and connections accepted by
+    every worker in shared memory."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pids = multiprocessing.Array('l', self.worker_count)
+        self.accepts = multiprocessing.Array('l', self.worker_count)
+
+    def _serve(self, sock, worker_index):
+        self.pids[worker_index] = os.getpid()
+        super()._serve(sock, worker_index)
+
+    async def _connection_handler(self, reader, writer):
+        with self.accepts.get_lock():
+            self.accepts[self.worker_index] += 1
+        await super()._connection_handler(reader, writer)
+
+
+def make_document_root():
+    root = tempfile.mkdtemp(prefix='httpd-benchmark-')
+    for name, size in FILES.values():
+        with open(os.path.join(root, name), 'wb') as file:
+            file.write(os.urandom(size // 2).hex().encode())
+    return root
+
+
+def free_port(address):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((address, 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_server(address, port):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((address, port)).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'Server at {address}:{port} did not start')
+
+
+def cpu_seconds(pid):
+    """User and system CPU time of a process, None where /proc is absent."""
+    try:
+        with open(f'/proc/{pid}/stat') as file:
+            # the command name may contain spaces, fields follow its ')'
+            fields = file.read().rpartition(')')[2].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def percentile(sorted_values, share):
+    if not sorted_values:
+        return 0
+    index = min(int(len(sorted_values) * share), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def _read_response(reader):
+    """Reads a response, returns its status and whether the server keeps
+    the connection open."""
+    head = await reader.readuntil(RESPONSE_HEAD_ENDING)
+    status = int(head.split(None, 2)[1])
+    length = 0
+    keep_alive = True
+    for line in head.split(b'\r\n')[1:]:
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            length = int(value)
+        elif name == b'connection':
+            keep_alive = value.strip().lower() == b'keep-alive'
+    await reader.readexactly(length)
+    return status, keep_alive
+
+
+async def _client(address, port, request, keep_alive, deadline, results):
+    connection = None
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            if connection is None:
+                connection = await asyncio.open_connection(address, port)
+            reader, writer = connection
+            writer.write(request)
+            status, reusable = await _read_response(reader)
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            status, reusable = 'error', False
+        results['latencies'].append(time.monotonic() - started)
+        results['codes'][status] = results['codes'].get(status, 0) + 1
+        if not (keep_alive and reusable) and connection is not None:
+            connection[1].close()
+            connection = None
+    if connection is not None:
+        connection[1].close()
+
+
+async def _load(address, port, path, keep_alive, concurrency, duration,
+                results):
+    connection = 'keep-alive' if keep_alive else 'close'
+    request = (f'GET /{path} HTTP/1.1\r\nHost: {address}\r\n'
+               f'Connection: {connection}\r\n\r\n').encode()
+    deadline = time.monotonic() + duration
+    await asyncio.gather(*[
+        _client(address, port, request, keep_alive, deadline, results)
+        for _ in range(concurrency)])
+
+
+def run_load(address, port, path, keep_alive, concurrency, duration):
+    """Runs clients on an event loop of its own, returns latencies of all
+    requests and counts of response codes."""
+    results = {'latencies': [], 'codes': {}}
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_load(address, port, path, keep_alive,
+                                      concurrency, duration, results))
+    finally:
+        loop.close()
+    return results
+
+
+def run_clients(opts, port, path, keep_alive):
+    """Spreads the concurrency between client processes, a single event loop
+    is easily outrun by several server workers."""
+    processes = opts.client_processes
+    base, extra = divmod(opts.concurrency, processes)
+    shares = [base + (i < extra) for i in range(processes)]
+    args = [(opts.address, port, path, keep_alive, share, opts.duration)
+            for share in shares if share]
+    with multiprocessing.Pool(len(args)) as pool:
+        parts = pool.starmap(run_load, args)
+    latencies = sorted(itertools.chain.from_iterable(
+        part['latencies'] for part in parts))
+    codes = {}
+    for part in parts:
+        for code, count in part['codes'].items():
+            codes[str(code)] = codes.get(str(code), 0) + count
+    return latencies, codes
+
+
+def run_scenario(opts, root, workers, mode, keep_alive, file):
+    port = free_port(opts.address)
+    server = BenchmarkServer(opts.address, port, root, workers,
+                             reuse_port=MODES[mode],
+                             cpu_affinity=opts.cpu_affinity)
+    process = multiprocessing.Process(target=server.start)
+    process.start()
+    try:
+        wait_for_server(opts.address, port)
+        # connections of the readiness probe are not a part of the load
+        time.sleep(0.2)
+        accepts_before = list(server.accepts)
+        cpu_before = [cpu_seconds(pid) for pid in server.pids]
+        started = time.monotonic()
+        latencies, codes = run_clients(opts, port, FILES[file][0],
+                                       KEEP_ALIVE_MODES[keep_alive])
+        elapsed = time.monotonic() - started
+        cpu_after = [cpu_seconds(pid) for pid in server.pids]
+    finally:
+        os.kill(process.pid, signal.SIGTERM)
+        process.join()
+    ok = sum(count for code, count in codes.items()
+             if code.isdigit() and int(code) < 400)
+    return {
+        'name': f'{workers}w-{mode}-keepalive-{keep_alive}-{file}',
+        'workers': workers,
+        'mode': mode,
+        'keep_alive': keep_alive,
+        'file': file,
+        'requests': len(latencies),
+        'rps': ok / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': (latencies[-1] if latencies else 0) * 1000,
+        'codes': codes,
+        'accepts': [after - before for after, before
+                    in zip(server.accepts, accepts_before)],
+        # share of one CPU used by every worker during the load
+        'worker_cpu': [round((after - before) / elapsed, 3)
+                       if None not in (before, after) else None
+                       for before, after in zip(cpu_before, cpu_after)],
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def report(result):
+    accepts = result['accepts']
+    mean = statistics.mean(accepts)
+    spread = statistics.pstdev(accepts) / mean if mean else 0
+    codes = ', '.join(f'{code}: {count}' for code, count
+                      in sorted(result['codes'].items()))
+    print(f'{result["name"]}: {result["rps"]:.1f} rps, '
+          f'p50 {result["p50_ms"]:.2f} ms, p99 {result["p99_ms"]:.2f} ms, '
+          f'max {result["max_ms"]:.2f} ms, codes {codes}')
+    print(f'  accepts per worker: {accepts} (coefficient of variation '
+          f'{spread:.3f}), worker CPU: {result["worker_cpu"]}')
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as file:
+        baseline = {result['name']: result
+                    for result in json.load(file)['results']}
+    print(f'Compared with {baseline_path}:')
+    for result in results:
+        previous = baseline.get(result['name'])
+        if previous is None:
+            continue
+        rps_change = ((result['rps'] / previous['rps'] - 1) * 100
+                      if previous['rps'] else 0)
+        print(f'{result["name"]}: rps {previous["rps"]:.1f} -> '
+              f'{result["rps"]:.1f} ({rps_change:+.1f}%), p99 '
+              f'{previous["p99_ms"]:.2f} -> {result["p99_ms"]:.2f} ms')
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-w", "--workers", action="store", type=str,
+                      default='1,2,4', help="comma separated worker counts")
+    parser.add_option("-m", "--modes", action="store", type=str,
+                      default=','.join(MODES),
+                      help="comma separated socket modes: shared, reuseport")
+    parser.add_option("-k", "--keep-alive", action="store", type=str,
+                      default=','.join(KEEP_ALIVE_MODES),
+                      help="comma separated keep-alive modes: on, off")
+    parser.add_option("-f", "--files", action="store", type=str,
+                      default=','.join(FILES),
+                      help="comma separated requested files: small, large")
+    parser.add_option("-c", "--concurrency", action="store", type=int,
+                      default=64)
+    parser.add_option("-p", "--client-processes", action="store", type=int,
+                      default=2)
+    parser.add_option("-d", "--duration", action="store", type=float,
+                      default=5, help="seconds of load per scenario")
+    parser.add_option("-a", "--address", action="store", type=str,
+                      default='127.0.0.1')
+    parser.add_option("-o", "--output", action="store", type=str,
+                      default=None, help="path to save JSON results to")
+    parser.add_option("--compare", action="store", type=str, default=None,
+                      help="path to JSON results to compare with")
+    parser.add_option("--cpu-affinity", action="store_true", default=False)
+    (opts, args) = parser.parse_args()
+    scenarios = list(itertools.product(
+        [int(workers) for workers in _split(opts.workers)],
+        _split(opts.modes), _split(opts.keep_alive), _split(opts.files)))
+    for _, mode, keep_alive, file in scenarios:
+        known = (mode in MODES, keep_alive in KEEP_ALIVE_MODES, file in FILES)
+        if not all(known):
+            parser.error(f'Unknown scenario {mode}, {keep_alive}, {file}')
+    root = make_document_root()
+    results = []
+    try:
+        for scenario in scenarios:
+            result = run_scenario(opts, root, *scenario)
+            report(result)
+            results.append(result)
+    finally:
+        shutil.rmtree(root)
+    if opts.output:
+        with open(opts.output, 'w') as file:
+            json.dump({'environment': environment(), 'options': vars(opts),
+                       'results': results}, file, indent=2)
+    if opts.compare:
+        compare(results, opts.compare)
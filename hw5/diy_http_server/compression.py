@@ -0,0 +1,138 @@
+import asyncio
+import zlib
+
+from collections import OrderedDict
+
+from file_cache import validator_headers
+
+GZIP_ENCODING = 'gzip'
+GZIP_SUFFIX = '.gz'
+VARY_HEADER = b'Vary: Accept-Encoding\r\n'
+COMPRESSION_LEVEL = 6
+MIN_COMPRESSED_FILE_SIZE = 256
+MAX_COMPRESSED_FILE_SIZE = 4 * 1024 * 1024
+MAX_CACHE_SIZE = 16 * 1024 * 1024
+COMPRESSIBLE_TYPES = {
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'application/xhtml+xml',
+    'application/rss+xml',
+    'application/atom+xml',
+    'application/wasm',
+    'image/svg+xml',
+    'image/x-icon',
+    'image/vnd.microsoft.icon',
+    'font/ttf',
+    'font/otf',
+}
+
+
+def is_compressible(content_type):
+    if content_type.startswith('text/'):
+        return True
+    return content_type in COMPRESSIBLE_TYPES
+
+
+def accepts_gzip(header_value):
+    """Checks Accept-Encoding header value, explicit gzip q-value wins
+    over the one of '*'."""
+    qualities = {}
+    for part in header_value.split(','):
+        coding, _, params = part.partition(';')
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    for coding in (GZIP_ENCODING, 'x-gzip', '*'):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+def gzip_compress(data, level=COMPRESSION_LEVEL):
+    # wbits=31 writes a gzip container with zero mtime, so output is stable
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _read_and_compress(path, level):
+    with open(path, 'rb') as file:
+        return gzip_compress(file.read(), level)
+
+
+def gzip_variant(info, size, content=None, path=None, etag=None):
+    """FileInfo of the gzip encoded representation of a file."""
+    etag = (etag or info.etag)[:-1] + '-gz"'
+    validators = validator_headers(etag, info.last_modified)
+    headers = (f'Content-Length: {size}\r\n'
+               f'Content-Type: {info.content_type}\r\n'
+               f'Content-Encoding: {GZIP_ENCODING}\r\n').encode() + validators
+    return info._replace(path=path or info.path, size=size, etag=etag,
+                         headers=headers, validators=validators,
+                         content=content)
+
+
+class CompressedCache(object):
+    """LRU cache of gzip compressed file contents of a worker.
+
+    Entries are keyed by path and file version, so a changed file is
+    compressed again and its old entry ages out. Concurrent requests of
+    the same file share one compression job run in the executor.
+    """
+
+    def __init__(self, max_size=MAX_CACHE_SIZE, level=COMPRESSION_LEVEL,
+                 executor=None):
+        self.max_size = max_size
+        self.level = level
+        # object with run(func, *args) returning a future, default executor
+        # of the loop is used if None
+        self.executor = executor
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    async def get(self, info):
+        key = (info.path, info.version)
+        compressed = self._entries.get(key)
+        if compressed is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return compressed
+        self.misses += 1
+        future = self._pending.get(key)
+        if future is None:
+            if info.content is not None:
+                future = self._run(gzip_compress, info.content, self.level)
+            else:
+                future = self._run(_read_and_compress, info.path, self.level)
+            future = asyncio.ensure_future(future)
+            self._pending[key] = future
+            future.add_done_callback(
+                lambda f: self._on_compressed(key, f))
+        return await asyncio.shield(future)
+
+    def _run(self, func, *args):
+        if self.executor is not None:
+            return self.executor.run(func, *args)
+        return asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    def _on_compressed(self, key, future):
+        self._pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        compressed = future.result()
+        if len(compressed) > self.max_size:
+            return
+        self._entries[key] = compressed
+        self._size += len(compressed)
+        while self._size > self.max_size:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
@@ -0,0 +1,122 @@
+import logging
+import os
+import time
+
+from urllib.parse import unquote
+
+CHECK_INTERVAL_SECONDS = 1.0
+MAX_INDEX_ENTRIES = 100000
+INDEX_FILE = 'index.html'
+
+
+def request_path(resource):
+    """URL path of a request target with the query dropped, percent
+    decoded and index file appended to directory paths."""
+    path = resource.partition('?')[0]
+    if '%' in path:
+        path = unquote(path)
+    if not path.startswith('/'):
+        path = '/' + path
+    if path.endswith('/'):
+        path = path + INDEX_FILE
+    return path
+
+
+def _is_inside(path, root):
+    return path == root or path.startswith(root + os.sep)
+
+
+def _scan(root, max_entries):
+    """Maps URL paths to real paths of regular files inside the root,
+    symlinks leading out of it are skipped. Returns None instead of the
+    index if there are more than max_entries files, along with mtimes of
+    the scanned directories."""
+    index = {}
+    directories = {}
+    stack = [(root, '/', frozenset())]
+    while stack:
+        directory, url_directory, parents = stack.pop()
+        if directory in parents:
+            # a symlink to a directory containing it
+            continue
+        parents = parents | {directory}
+        try:
+            directories[directory] = os.stat(directory).st_mtime_ns
+            entries = list(os.scandir(directory))
+        except OSError:
+            continue
+        for entry in entries:
+            path = entry.path
+            try:
+                if entry.is_symlink():
+                    path = os.path.realpath(path)
+                    if not _is_inside(path, root):
+                        continue
+                if entry.is_dir():
+                    stack.append((path, url_directory + entry.name + '/',
+                                  parents))
+                elif entry.is_file():
+                    index[url_directory + entry.name] = path
+            except OSError:
+                continue
+        if len(index) > max_entries:
+            return None, directories
+    return index, directories
+
+
+class DocumentRoot(object):
+    """Resolves request paths to real paths of files in the document root.
+
+    All files of the root are kept in a dict from URL path to real path, so
+    resolving a path is a lookup and a path leading out of the root can't
+    be in it. Every check_interval seconds refresh stats the indexed
+    directories and scans the root again if any of them changed. Roots with
+    more than max_entries files are not indexed, their paths are resolved
+    with realpath on every request.
+    """
+
+    def __init__(self, root, check_interval=CHECK_INTERVAL_SECONDS,
+                 max_entries=MAX_INDEX_ENTRIES):
+        self.root = os.path.realpath(root)
+        self.check_interval = check_interval
+        self.max_entries = max_entries
+        self.checked_at = 0
+        self._index = None
+        self._directories = {}
+        self._scan()
+
+    def resolve(self, path):
+        """Returns the real path of a file for a URL path returned by
+        request_path, None if there is no such file in the root."""
+        index = self._index
+        if index is not None:
+            return index.get(path)
+        real_path = os.path.realpath(os.path.join(self.root, path[1:]))
+        if _is_inside(real_path, self.root) and os.path.isfile(real_path):
+            return real_path
+        return None
+
+    def needs_check(self):
+        return time.monotonic() - self.checked_at >= self.check_interval
+
+    def refresh(self):
+        """Scans the root again if any directory of it changed, safe to run
+        in a thread as the index is swapped at once."""
+        for directory, mtime in self._directories.items():
+            try:
+                changed = os.stat(directory).st_mtime_ns != mtime
+            except OSError:
+                changed = True
+            if changed:
+                self._scan()
+                return True
+        self.checked_at = time.monotonic()
+        return False
+
+    def _scan(self):
+        index, directories = _scan(self.root, self.max_entries)
+        if index is None:
+            logging.warning(f'Document root {self.root} has more than '
+                            f'{self.max_entries} files, it is not indexed.')
+        self._index, self._directories = index, directories
+        self.checked_at = time.monotonic()
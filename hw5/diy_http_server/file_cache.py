@@ -0,0 +1,168 @@
+import asyncio
+import mimetypes
+import os
+import stat
+import time
+
+from collections import OrderedDict, namedtuple
+from wsgiref.handlers import format_date_time
+
+DEFAULT_CONTENT_TYPE = 'application/octet-stream'
+CHECK_INTERVAL_SECONDS = 1.0
+MAX_CACHED_FILE_SIZE = 64 * 1024
+MAX_CACHE_SIZE = 32 * 1024 * 1024
+MAX_CACHE_ENTRIES = 4096
+# passed to _revalidate for a path without a cache entry
+_NOT_CACHED = object()
+
+
+class FileInfo(namedtuple('FileInfo', [
+        'path', 'size', 'mtime', 'inode', 'content_type', 'etag',
+        'last_modified', 'headers', 'validators', 'content'])):
+    """Stat data of a regular file with response headers precomputed.
+
+    headers are the encoded entity header lines of a full response,
+    validators the ETag and Last-Modified lines of them. content holds the
+    file bytes for small files and is None for files that are sent from disk.
+    """
+
+    @property
+    def version(self):
+        return self.inode, self.mtime, self.size
+
+
+class FileCache(object):
+    """Per worker LRU cache of file metadata and small file contents.
+
+    Entries are trusted for check_interval seconds, after that the file is
+    stat-ed again and the entry is rebuilt if its inode, mtime or size
+    changed. Missing files are cached the same way. Files are stat-ed and
+    read in the executor, concurrent requests of the same path share one
+    job.
+    """
+
+    def __init__(self, check_interval=CHECK_INTERVAL_SECONDS,
+                 max_file_size=MAX_CACHED_FILE_SIZE,
+                 max_size=MAX_CACHE_SIZE, max_entries=MAX_CACHE_ENTRIES,
+                 executor=None):
+        self.check_interval = check_interval
+        self.max_file_size = max_file_size
+        self.max_size = max_size
+        self.max_entries = max_entries
+        # object with run(func, *args) returning a future, default executor
+        # of the loop is used if None
+        self.executor = executor
+        self.hits = 0
+        self.misses = 0
+        self._size = 0
+        # path -> (FileInfo or None for missing files, checked_at)
+        self._entries = OrderedDict()
+        self._pending = {}
+
+    async def get(self, path):
+        """Returns FileInfo of a regular file or None if there is no such."""
+        entry = self._entries.get(path)
+        if entry is not None:
+            info, checked_at = entry
+            if time.monotonic() - checked_at < self.check_interval:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return info
+        future = self._pending.get(path)
+        if future is None:
+            cached = entry[0] if entry is not None else _NOT_CACHED
+            future = asyncio.ensure_future(self._run(
+                _revalidate, path, cached, self.max_file_size))
+            self._pending[path] = future
+            future.add_done_callback(
+                lambda f: self._on_revalidated(path, f))
+        info, loaded = await asyncio.shield(future)
+        if loaded:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return info
+
+    def _run(self, func, *args):
+        if self.executor is not None:
+            return self.executor.run(func, *args)
+        return asyncio.get_event_loop().run_in_executor(None, func, *args)
+
+    def _on_revalidated(self, path, future):
+        self._pending.pop(path, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        info, _ = future.result()
+        self._put(path, info, time.monotonic())
+
+    def _put(self, path, info, now):
+        self._remove(path)
+        self._entries[path] = (info, now)
+        self._size += _content_size(info)
+        while self._entries and self._is_full():
+            self._remove(next(iter(self._entries)))
+
+    def _is_full(self):
+        too_many = len(self._entries) > self.max_entries
+        return too_many or self._size > self.max_size
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry is not None:
+            self._size -= _content_size(entry[0])
+
+
+def validator_headers(etag, last_modified):
+    return f'ETag: {etag}\r\nLast-Modified: {last_modified}\r\n'.encode()
+
+
+def _content_size(info):
+    return len(info.content) if info and info.content is not None else 0
+
+
+def _stat_version(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _revalidate(path, cached, max_file_size):
+    """Returns the cached FileInfo (or None) if the file didn't change, its
+    new FileInfo otherwise, along with whether the file was loaded."""
+    if cached is not _NOT_CACHED:
+        if _stat_version(path) == (cached.version if cached else None):
+            return cached, False
+    return _load(path, max_file_size), True
+
+
+def _load(path, max_file_size):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    content = None
+    if st.st_size <= max_file_size:
+        try:
+            with open(path, 'rb') as file:
+                content = file.read()
+        except OSError:
+            return None
+        if len(content) != st.st_size:
+            # file changed while being read, send it from disk this time
+            content = None
+    content_type = mimetypes.guess_type(path)[0] or DEFAULT_CONTENT_TYPE
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    last_modified = format_date_time(st.st_mtime)
+    validators = validator_headers(etag, last_modified)
+    headers = (f'Content-Length: {st.st_size}\r\n'
+               f'Content-Type: {content_type}\r\n'
+               f'Accept-Ranges: bytes\r\n').encode() + validators
+    return FileInfo(path, st.st_size, st.st_mtime_ns, st.st_ino,
+                    content_type, etag, last_modified, headers, validators,
+                    content)
@@ -1,31 +1,65 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+import ipaddress
 import logging
 import selectors
-import multiprocessing
 import asyncio
 import socket
 import signal
-import mimetypes
 import os
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import closing
-from datetime import datetime
+from functools import partial
+from email.utils import parsedate_to_datetime
 from enum import Enum
 from optparse import OptionParser
 from wsgiref.handlers import format_date_time
-from urllib import request
-from urllib.parse import unquote
-from time import mktime
 
-HTTP_HEADERS_ENDING = '\r\n\r\n'
-RESPONSE_LINE_ENDING = '\r\n'
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+from access_log import AccessLog, LOG_FORMATS
+from docroot import DocumentRoot, request_path
+from compression import (CompressedCache, GZIP_SUFFIX, VARY_HEADER,
+                         MIN_COMPRESSED_FILE_SIZE, MAX_COMPRESSED_FILE_SIZE,
+                         accepts_gzip, gzip_variant, is_compressible)
+from file_cache import FileCache, CHECK_INTERVAL_SECONDS, MAX_CACHED_FILE_SIZE
+from stats import StatsTable, WorkerStats, render_status
+from supervisor import (Supervisor, HealthTable, Handover, reexec,
+                        GRACEFUL_TIMEOUT_SECONDS, HEARTBEAT_TIMEOUT_SECONDS,
+                        LISTEN_FD_ENV)
+from request_parser import (RequestParser, ParseError, BodyTooLargeError,
+                            HeadersTooLargeError, RequestLineTooLongError,
+                            UnsupportedTransferEncodingError, MAX_HEADER_SIZE,
+                            MAX_BODY_SIZE)
+
+RESPONSE_LINE_ENDING = b'\r\n'
 HTTP_VERSION_STRING = 'HTTP/1.1'
+HTTP_1_0_VERSION_STRING = 'HTTP/1.0'
+SERVER_NAME = 'DIY HTTP Server'
+
+# response headers are kept as encoded header lines ending with CRLF
+PLAIN_TEXT_EMPTY_CONTENT = (b'Content-Type: text/plain; charset=utf-8\r\n'
+                            b'Content-Length: 0\r\n')
+STATUS_CONTENT_HEADERS = (b'Content-Type: application/json\r\n'
+                          b'Cache-Control: no-store\r\n')
 
-PLAIN_TEXT_EMPTY_CONTENT = [
-    'Content-Type: text/plain; charset=utf-8',
-    'Content-Length: {}'
-]
+KEEP_ALIVE_TIMEOUT_SECONDS = 5
+MAX_KEEP_ALIVE_REQUESTS = 100
+REQUEST_TIMEOUT_SECONDS = 10
+FILE_CHUNK_SIZE = 256 * 1024
+READ_CHUNK_SIZE = 64 * 1024
+MAX_CONNECTIONS = 1024
+IO_THREADS = 8
+MAX_IO_QUEUE_SIZE = 64
+WRITE_BUFFER_SIZE = 64 * 1024
+REJECT_LINGER_SECONDS = 0.5
+RETRY_AFTER_HEADER = b'Retry-After: 1\r\n'
+STATUS_PATH = '/server-status'
 
 
 class Error(Exception):
@@ -33,189 +67,807 @@ class Error(Exception):
     pass
 
 
-class BadRequestError(Error):
-    """Request has an unexpected structure and is not parseable."""
+class RangeNotSatisfiableError(Error):
+    """Requested byte range lies outside of the file."""
+    pass
+
+
+class ServerBusyError(Error):
+    """Worker has no capacity left to serve the request."""
     pass
 
 
 class HttpCode(Enum):
     BAD_REQUEST = (400, 'Bad Request')
     OK = (200, 'OK')
+    PARTIAL_CONTENT = (206, 'Partial Content')
+    NOT_MODIFIED = (304, 'Not Modified')
     FORBIDDEN = (403, 'Forbidden')
     NOT_FOUND = (404, 'Not Found')
     NOT_ALLOWED = (405, 'Method Not Allowed')
+    REQUEST_TIMEOUT = (408, 'Request Timeout')
+    PAYLOAD_TOO_LARGE = (413, 'Payload Too Large')
+    URI_TOO_LONG = (414, 'URI Too Long')
+    RANGE_NOT_SATISFIABLE = (416, 'Range Not Satisfiable')
+    HEADERS_TOO_LARGE = (431, 'Request Header Fields Too Large')
     SERVER_ERROR = (500, 'Internal Server Error')
+    NOT_IMPLEMENTED = (501, 'Not Implemented')
+    SERVICE_UNAVAILABLE = (503, 'Service Unavailable')
 
     def __init__(self, code, short_message):
         self.code = code
         self.short_message = short_message
-
-    def to_response_line(self):
-        return ' '.join([HTTP_VERSION_STRING, str(self.code),
-                         self.short_message])
+        self.response_line = (f'{HTTP_VERSION_STRING} {code} '
+                              f'{short_message}\r\n').encode()
 
 
 def _generate_response_lines(http_code, headers):
-    lines = [http_code.to_response_line()] + headers
-    response_string = RESPONSE_LINE_ENDING.join(lines) + HTTP_HEADERS_ENDING
-    return response_string.encode()
+    return http_code.response_line + headers + RESPONSE_LINE_ENDING
+
+
+def _current_task():
+    if hasattr(asyncio, 'current_task'):
+        return asyncio.current_task()
+    return asyncio.Task.current_task()
+
+
+def _writable(loop, fd):
+    """Future resolved once fd is writable."""
+    future = loop.create_future()
+    loop.add_writer(fd, lambda: future.done() or future.set_result(None))
+    future.add_done_callback(lambda _: loop.remove_writer(fd))
+    return future
+
+
+def _date_header():
+    return f'Date: {format_date_time(time.time())}\r\n'.encode()
+
+
+def _parse_error_code(error):
+    if isinstance(error, RequestLineTooLongError):
+        return HttpCode.URI_TOO_LONG
+    if isinstance(error, HeadersTooLargeError):
+        return HttpCode.HEADERS_TOO_LARGE
+    if isinstance(error, BodyTooLargeError):
+        return HttpCode.PAYLOAD_TOO_LARGE
+    if isinstance(error, UnsupportedTransferEncodingError):
+        return HttpCode.NOT_IMPLEMENTED
+    return HttpCode.BAD_REQUEST
+
+
+LOOPS = ('auto', 'uvloop', 'asyncio')
+
+
+def new_event_loop(kind='auto'):
+    """uvloop loop if it is installed (or asked for), stdlib selector loop
+    otherwise."""
+    if kind not in LOOPS:
+        raise ValueError(f'Unknown event loop {kind}')
+    if kind == 'uvloop' and uvloop is None:
+        raise ValueError('uvloop is not installed')
+    if uvloop is not None and kind != 'asyncio':
+        return uvloop.new_event_loop()
+    return asyncio.SelectorEventLoop(selectors.DefaultSelector())
+
+
+def _is_local(address):
+    try:
+        return ipaddress.ip_address(address[0]).is_loopback
+    except (TypeError, ValueError, IndexError):
+        return False
+
 
+def _is_keep_alive(version, headers):
+    connection = headers.get('connection', '').lower()
+    if version == HTTP_1_0_VERSION_STRING:
+        return connection == 'keep-alive'
+    return connection != 'close'
 
-def _parse_headers(header_lines):
-    headers = {}
-    for line in header_lines:
-        line.strip()
-        if line:
-            header, value = line.split(': ')
-            headers[header] = value
-    return headers
 
+def _etag_matches(etag, header_value):
+    """Weak comparison of etag with an If-None-Match header value."""
+    if header_value.strip() == '*':
+        return True
+    for candidate in header_value.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
 
-def _parse_path(resource_string):
-    decoded = unquote(resource_string)
-    path = decoded
-    if '?' in decoded:
-        path, unused_query_string = decoded.split('?')
-    if path.endswith('/'):
-        path = path + 'index.html'
-    if path.startswith('/'):
-        path = path[1:]
-    return path
+
+def _is_modified_since(info, header_value):
+    try:
+        since = parsedate_to_datetime(header_value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return True
+    # http dates have a precision of one second
+    return info.mtime // 1000000000 > since
+
+
+def _is_not_modified(info, request_headers):
+    if 'if-none-match' in request_headers:
+        return _etag_matches(info.etag, request_headers['if-none-match'])
+    if 'if-modified-since' in request_headers:
+        return not _is_modified_since(info,
+                                      request_headers['if-modified-since'])
+    return False
+
+
+def _parse_range(header_value, size):
+    """Parses a single byte range, returns inclusive (start, end) or None if
+    the header should be ignored."""
+    unit, _, ranges = header_value.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        # other units and multiple ranges are not supported
+        return None
+    first, dash, last = ranges.partition('-')
+    first, last = first.strip(), last.strip()
+    if not dash or not (first or last):
+        return None
+    if (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+    if not first:
+        suffix_length = int(last)
+        if suffix_length == 0 or size == 0:
+            raise RangeNotSatisfiableError(header_value)
+        return max(size - suffix_length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if last and end < start:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiableError(header_value)
+    return start, min(end, size - 1)
+
+
+def _requested_range(info, request_headers):
+    if 'range' not in request_headers:
+        return None
+    if_range = request_headers.get('if-range')
+    if if_range is not None and if_range.strip() not in (
+            info.etag, info.last_modified):
+        return None
+    return _parse_range(request_headers['range'], info.size)
+
+
+class BoundedExecutor(object):
+    """Thread pool for blocking file I/O of a worker that refuses new jobs
+    once max_queue_size of them are queued or running, so a spike of
+    requests can't pile up an unbounded backlog."""
+
+    def __init__(self, max_workers=IO_THREADS,
+                 max_queue_size=MAX_IO_QUEUE_SIZE):
+        self.max_queue_size = max_queue_size
+        self.pending = 0
+        # threads are started on first use, i.e. in worker processes
+        self._executor = ThreadPoolExecutor(max_workers)
+
+    def run(self, func, *args):
+        if self.pending >= self.max_queue_size:
+            raise ServerBusyError(f'{self.pending} file I/O jobs are pending')
+        self.pending += 1
+        future = asyncio.get_event_loop().run_in_executor(
+            self._executor, func, *args)
+        future.add_done_callback(self._on_done)
+        return future
+
+    def _on_done(self, unused_future):
+        self.pending -= 1
+
+
+class ResponseBatch(object):
+    """Responses to pipelined requests of a connection collected to be
+    written with a single write and drain.
+
+    Responses are sent once no complete request is left buffered, before a
+    file is sent from disk or when the batch grows over max_size.
+    """
+
+    def __init__(self, writer, max_size=WRITE_BUFFER_SIZE):
+        self.writer = writer
+        self.max_size = max_size
+        self._parts = []
+        self._size = 0
+
+    @property
+    def is_full(self):
+        return self._size >= self.max_size
+
+    def write(self, data):
+        self._parts.append(data)
+        self._size += len(data)
+
+    async def flush(self):
+        if self._parts:
+            self.writer.write(b''.join(self._parts))
+            self._parts = []
+            self._size = 0
+        await self.writer.drain()
 
 
 class DIYHTTPServer(object):
-    def __init__(self, address, port, root, worker_count):
+    def __init__(self, address, port, root, worker_count,
+                 keep_alive_timeout=KEEP_ALIVE_TIMEOUT_SECONDS,
+                 max_keep_alive_requests=MAX_KEEP_ALIVE_REQUESTS,
+                 cache_check_interval=CHECK_INTERVAL_SECONDS,
+                 max_cached_file_size=MAX_CACHED_FILE_SIZE, gzip=True,
+                 reuse_port=False, cpu_affinity=False,
+                 max_header_size=MAX_HEADER_SIZE, max_body_size=MAX_BODY_SIZE,
+                 request_timeout=REQUEST_TIMEOUT_SECONDS, access_log=None,
+                 access_log_format='combined', access_log_sample_rate=1.0,
+                 max_connections=MAX_CONNECTIONS, io_threads=IO_THREADS,
+                 max_io_queue_size=MAX_IO_QUEUE_SIZE,
+                 write_buffer_size=WRITE_BUFFER_SIZE,
+                 graceful_timeout=GRACEFUL_TIMEOUT_SECONDS,
+                 heartbeat_timeout=HEARTBEAT_TIMEOUT_SECONDS, loop='auto',
+                 status_path=STATUS_PATH):
+        if loop not in LOOPS or (loop == 'uvloop' and uvloop is None):
+            raise ValueError(f'Event loop {loop} is not available')
+        if reuse_port and not hasattr(socket, 'SO_REUSEPORT'):
+            raise ValueError('SO_REUSEPORT is not supported on this platform')
         self.address = address
         self.port = port
         self.root = os.path.abspath(root)
+        # scanned once here, workers keep refreshing their own copies
+        self.docroot = DocumentRoot(root, cache_check_interval)
+        self.loop = loop
+        self._docroot_refresh = None
+        self._sendfile_supported = True
+        self._chunked_send_logged = False
+        self._master_pid = None
         self.worker_count = worker_count
-        self._workers = set()
+        self.keep_alive_timeout = keep_alive_timeout
+        self.max_keep_alive_requests = max_keep_alive_requests
+        self.max_header_size = max_header_size
+        self.max_body_size = max_body_size
+        self.request_timeout = request_timeout
+        self.max_connections = max_connections
+        self.write_buffer_size = write_buffer_size
+        self.graceful_timeout = graceful_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self._connections = 0
+        self._connection_tasks = set()
+        # connections waiting for the next request, closed on shutdown
+        self._idle_connections = set()
+        self._closing = False
+        self._connection_headers = {
+            False: (f'Server: {SERVER_NAME}\r\n'
+                    f'Connection: close\r\n').encode(),
+            True: (f'Server: {SERVER_NAME}\r\n'
+                   f'Connection: keep-alive\r\n'
+                   f'Keep-Alive: timeout={keep_alive_timeout}, '
+                   f'max={max_keep_alive_requests}\r\n').encode(),
+        }
+        self._date = _date_header()
+        # writer thread is started in every worker after fork
+        self.access_log = (AccessLog(access_log, access_log_format,
+                                     access_log_sample_rate)
+                           if access_log else None)
+        self.io_executor = BoundedExecutor(io_threads, max_io_queue_size)
+        # every worker process gets its own copy after fork
+        self.file_cache = FileCache(cache_check_interval,
+                                    max_cached_file_size,
+                                    executor=self.io_executor)
+        self.gzip = gzip
+        self.compressed_cache = CompressedCache(executor=self.io_executor)
+        self.reuse_port = reuse_port
+        self.cpu_affinity = cpu_affinity
+        self.worker_index = None
+        self.health = HealthTable(worker_count)
+        # served to local clients only, None disables it
+        self.status_path = status_path
+        self.stats = StatsTable(worker_count)
+        self._stats = WorkerStats()
+
+    def _bind_socket(self):
+        # asyncio disables Nagle's algorithm only on sockets of IPPROTO_TCP,
+        # accepted sockets inherit the protocol of the listening one
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM,
+                             socket.IPPROTO_TCP)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.address, self.port))
+        return sock
+
+    def _listening_socket(self):
+        """Shared listening socket, the one passed by the previous master
+        image on reload if it is still bound to the configured address."""
+        fd = os.environ.pop(LISTEN_FD_ENV, None)
+        sock = None
+        if fd is not None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM,
+                                 socket.IPPROTO_TCP, fileno=int(fd))
+            sock.set_inheritable(False)
+            address = socket.gethostbyname(self.address), self.port
+            if self.reuse_port or sock.getsockname() != address:
+                logging.info('Listening socket options changed, the '
+                             'inherited one is closed.')
+                sock.close()
+                sock = None
+        if self.reuse_port:
+            return None
+        return sock if sock is not None else self._bind_socket()
+
+    def _pin_to_cpu(self):
+        if not hasattr(os, 'sched_setaffinity'):
+            logging.warning('CPU affinity is not supported on this platform')
+            return
+        cpus = sorted(os.sched_getaffinity(0))
+        cpu = cpus[self.worker_index % len(cpus)]
+        os.sched_setaffinity(0, {cpu})
+        logging.info(f'Worker {self.worker_index} is pinned to CPU {cpu}')
 
-    def _serve(self, sock):
-        selector = selectors.EpollSelector()
-        loop = asyncio.SelectorEventLoop(selector)
+    def _serve(self, sock, worker_index):
+        self.worker_index = worker_index
+        self._pid = os.getpid()
+        # reload and health requests are handled by the supervisor
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        # handlers and wakeup fd of the supervisor are inherited on fork, stop
+        # requests simply kill the worker until its loop handles them
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        if self.cpu_affinity:
+            self._pin_to_cpu()
+        if sock is None:
+            # own listening socket, the kernel spreads connections between
+            # the sockets bound to the same port
+            sock = self._bind_socket()
+        if self.access_log:
+            self.access_log.start()
+        loop = new_event_loop(self.loop)
+        asyncio.set_event_loop(loop)
         coro = asyncio.start_server(self._connection_handler, sock=sock)
         server = loop.run_until_complete(coro)
-        loop.add_signal_handler(signal.SIGTERM, loop.stop)
-        loop.add_signal_handler(signal.SIGINT, loop.stop)
+        loop.call_soon(self._tick)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, loop.stop)
         logging.info(
-            f'Starting server worker at http://{self.address}:{self.port}')
+            f'Starting server worker {worker_index} (pid {self._pid}, '
+            f'{type(loop).__module__} loop) at '
+            f'http://{self.address}:{self.port}')
         try:
             loop.run_forever()
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                # the supervisor and the terminal may both ask to stop
+                loop.remove_signal_handler(signum)
+                signal.signal(signum, signal.SIG_IGN)
+            logging.info(f'Stopping server worker {worker_index}, '
+                         f'{self._connections} connections are open.')
+            loop.run_until_complete(self._shutdown(server))
         finally:
-            logging.info('Closing server worker...')
-            server.close()
-            coro.close()
-            loop.run_until_complete(coro)
+            if self.access_log:
+                self.access_log.stop()
+            loop.close()
+            logging.info(f'Server worker {worker_index} stopped.')
 
-    def terminate(self, unused_signum, unused_frame):
-        logging.info('Termination arequest received, shutting down workers.')
-        for worker in self._workers:
-            worker.terminate()
+    async def _shutdown(self, server):
+        """Stops accepting connections, closes idle ones and gives the rest
+        graceful_timeout to finish their responses."""
+        self._closing = True
+        server.close()
+        for task in list(self._idle_connections):
+            task.cancel()
+        if self._connection_tasks:
+            _, pending = await asyncio.wait(self._connection_tasks,
+                                            timeout=self.graceful_timeout)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.wait(pending)
+        await server.wait_closed()
 
     def start(self):
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        sock.bind((self.address, self.port))
-
-        signal.signal(signal.SIGINT, self.terminate)
-        signal.signal(signal.SIGTERM, self.terminate)
-        for _ in range(self.worker_count):
-            worker = multiprocessing.Process(
-                target=self._serve, kwargs=dict(sock=sock))
-            worker.daemon = True
-            worker.start()
-            self._workers.add(worker)
-        sock.close()
-
-        for worker in self._workers:
-            worker.join()
+        # workers either share one listening socket or bind their own with
+        # SO_REUSEPORT, the shared one stays open for respawned workers
+        sock = self._listening_socket()
+        self._master_pid = os.getpid()
+        supervisor = Supervisor(partial(self._serve, sock), self.worker_count,
+                                self.health, self.heartbeat_timeout,
+                                graceful_timeout=self.graceful_timeout,
+                                handover=Handover.from_environ(os.environ))
+        handover = None
+        try:
+            handover = supervisor.run()
+        finally:
+            if sock is not None and handover is None:
+                sock.close()
+        if handover is not None:
+            # workers keep serving on the socket while the master restarts
+            reexec(handover, sock.fileno() if sock is not None else None)
 
     async def _connection_handler(self, reader, writer):
         with closing(writer) as client_writer:
             address = client_writer.get_extra_info('peername')
-            logging.info('Accepted connection from %s.', address)
-            raw_request = None
-            content = None
-            headers = PLAIN_TEXT_EMPTY_CONTENT
-            while True:
+            if self._connections >= self.max_connections:
+                await self._reject_connection(reader, client_writer, address)
+                return
+            logging.debug('Accepted connection from %s.', address)
+            client_writer.transport.set_write_buffer_limits(
+                self.write_buffer_size)
+            task = _current_task()
+            self._connections += 1
+            self._connection_tasks.add(task)
+            try:
+                await self._serve_connection(reader, client_writer, address)
+            finally:
+                self._connections -= 1
+                self._connection_tasks.discard(task)
+
+    async def _reject_connection(self, reader, client_writer, address):
+        """Answers 503 without parsing the request when the worker already
+        serves max_connections."""
+        headers = self._base_headers(False) + RETRY_AFTER_HEADER
+        headers += PLAIN_TEXT_EMPTY_CONTENT
+        client_writer.write(_generate_response_lines(
+            HttpCode.SERVICE_UNAVAILABLE, headers))
+        try:
+            client_writer.write_eof()
+            # closing a socket with unread request data resets the
+            # connection, and the client may lose the response
+            await asyncio.wait_for(reader.read(READ_CHUNK_SIZE),
+                                   timeout=REJECT_LINGER_SECONDS)
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        self._log_access(address, None, HttpCode.SERVICE_UNAVAILABLE, 0,
+                         None)
+
+    async def _serve_connection(self, reader, client_writer, address):
+        parser = RequestParser(max_header_size=self.max_header_size,
+                               max_body_size=self.max_body_size)
+        batch = ResponseBatch(client_writer, self.write_buffer_size)
+        try:
+            for served in range(1, self.max_keep_alive_requests + 1):
                 try:
-                    raw_request = await reader.readuntil(
-                        HTTP_HEADERS_ENDING.encode())
-                    if raw_request:
-                        break
-                except asyncio.IncompleteReadError:
+                    request = parser.next_request()
+                    if request is None:
+                        # responses to pipelined requests are sent at once
+                        await batch.flush()
+                        request = await self._read_request(reader, parser)
+                except asyncio.TimeoutError:
+                    if parser.has_pending_data:
+                        await self._write_error(batch, address,
+                                                HttpCode.REQUEST_TIMEOUT)
+                    break
+                except ParseError as e:
+                    logging.info('Malformed request from %s: %s', address, e)
+                    await self._write_error(batch, address,
+                                            _parse_error_code(e))
+                    break
+                if request is None:
+                    break
+                more_allowed = served < self.max_keep_alive_requests
+                keep_alive = await self._handle_request(
+                    request, batch, address,
+                    more_allowed and not self._closing)
+                if not keep_alive:
                     break
+            await batch.flush()
+        except ConnectionError:
+            # client went away before the responses were flushed
+            pass
+
+    async def _read_request(self, reader, parser):
+        """Reads from the client until the parser has a complete request,
+        returns None if the client closed the connection before that.
+
+        Waiting for a new request is limited by the keep-alive timeout, once
+        its first bytes are received the whole request has to arrive within
+        the request timeout."""
+        loop = asyncio.get_event_loop()
+        task = _current_task()
+        deadline = None
+        request = parser.next_request()
+        while request is None:
+            idle = not parser.has_pending_data
+            if idle:
+                if self._closing:
+                    return None
+                timeout = self.keep_alive_timeout
+                self._idle_connections.add(task)
+            else:
+                if deadline is None:
+                    deadline = loop.time() + self.request_timeout
+                timeout = deadline - loop.time()
             try:
-                method, resource, response_headers = self._tokenize_request(
-                    raw_request)
-                path = _parse_path(resource)
-                if method in ['GET', 'HEAD']:
-                    code, headers = self._create_get_or_head_response(
-                        path, response_headers)
-                    if method == 'GET' and code == HttpCode.OK:
-                        with open(os.path.join(self.root, path), 'rb') as fd:
-                            try:
-                                content = await self._read_data(fd)
-                            except IOError:
-                                logging.error('Error on reading requested file %s contents.', path)
-                                raise
-                else:
-                    code = HttpCode.NOT_ALLOWED
-            except BadRequestError as e:
-                logging.exception(e)
-                code = HttpCode.BAD_REQUEST
-            except Exception as e:
-                logging.exception(e)
-                code = HttpCode.SERVER_ERROR
-            client_writer.write(_generate_response_lines(code, headers))
-            if content:
-                client_writer.write(content)
+                data = await asyncio.wait_for(reader.read(READ_CHUNK_SIZE),
+                                              timeout=timeout)
+            finally:
+                if idle:
+                    self._idle_connections.discard(task)
+            if not data:
+                return None
+            parser.feed(data)
+            request = parser.next_request()
+        return request
+
+    async def _write_error(self, batch, address, code):
+        headers = self._base_headers(False) + PLAIN_TEXT_EMPTY_CONTENT
+        batch.write(_generate_response_lines(code, headers))
+        await batch.flush()
+        self._log_access(address, None, code, 0, None)
+
+    def _log_access(self, address, request, code, body_size, started):
+        """Counts the request in worker stats and writes it to the access
+        log."""
+        request_time = (asyncio.get_event_loop().time() - started
+                        if started is not None else 0)
+        self._stats.record(body_size, request_time)
+        if self.access_log is None:
+            return
+        if request is not None:
+            request_line = ' '.join([request.method, request.resource,
+                                     request.version])
+            headers = request.headers
+        else:
+            request_line = '-'
+            headers = {}
+        self.access_log.log(address[0] if address else '-', request_line,
+                            code.code, body_size,
+                            headers.get('referer', '-'),
+                            headers.get('user-agent', '-'), request_time)
+
+    async def _handle_request(self, request, batch, address,
+                              keep_alive_allowed):
+        """Writes response to one request to the batch, returns whether
+        the connection should be kept open for the next one."""
+        started = asyncio.get_event_loop().time()
+        body_size = 0
+        file = None
+        content = None
+        byte_range = None
+        headers = None
+        keep_alive = False
+        try:
+            method, request_headers = request.method, request.headers
+            keep_alive = keep_alive_allowed and _is_keep_alive(
+                request.version, request_headers)
+            path = request_path(request.resource)
+            is_status = path == self.status_path and _is_local(address)
+            if is_status and method in ['GET', 'HEAD']:
+                code = HttpCode.OK
+                status = self._status()
+                content_length = f'Content-Length: {len(status)}\r\n'
+                headers = self._base_headers(keep_alive)
+                headers += STATUS_CONTENT_HEADERS + content_length.encode()
+                if method == 'GET':
+                    content = status
+                    body_size = len(status)
+            elif method in ['GET', 'HEAD']:
+                code, headers, info, byte_range = (
+                    await self._create_get_or_head_response(
+                        path, self._base_headers(keep_alive),
+                        request_headers, method))
+                has_body = code in (HttpCode.OK, HttpCode.PARTIAL_CONTENT)
+                if method == 'GET' and has_body:
+                    body_size = (byte_range[1] - byte_range[0] + 1
+                                 if byte_range else info.size)
+                    if info.content is not None:
+                        content = info.content
+                        if byte_range:
+                            content = content[byte_range[0]:byte_range[1] + 1]
+                    else:
+                        file = open(info.path, 'rb')
+            else:
+                code = HttpCode.NOT_ALLOWED
+        except ServerBusyError as e:
+            logging.warning('Request of %s is rejected: %s', path, e)
+            keep_alive = False
+            code = HttpCode.SERVICE_UNAVAILABLE
+            headers = self._base_headers(keep_alive) + RETRY_AFTER_HEADER
+        except Exception as e:
+            logging.exception(e)
+            keep_alive = False
+            code = HttpCode.SERVER_ERROR
+        if code == HttpCode.SERVICE_UNAVAILABLE:
+            headers += PLAIN_TEXT_EMPTY_CONTENT
+        elif headers is None or code == HttpCode.SERVER_ERROR:
+            headers = self._base_headers(keep_alive) + PLAIN_TEXT_EMPTY_CONTENT
+        batch.write(_generate_response_lines(code, headers))
+        if content:
+            batch.write(content)
+        if file is not None:
+            with file:
+                try:
+                    # file contents go after the responses written so far
+                    await batch.flush()
+                    if byte_range:
+                        await self._send_file(
+                            file, batch.writer, byte_range[0],
+                            byte_range[1] - byte_range[0] + 1)
+                    else:
+                        await self._send_file(file, batch.writer)
+                except (IOError, ConnectionError, ServerBusyError):
+                    logging.exception('Error on sending requested file %s contents.', path)
+                    self._log_access(address, request, code, body_size,
+                                     started)
+                    # response is incomplete, the connection can't be reused
+                    return False
+        if batch.is_full:
+            await batch.flush()
+        self._log_access(address, request, code, body_size, started)
+        return keep_alive
+
+    def _tick(self):
+        """Runs once a second, at second boundaries: formats the Date
+        header and reports the worker is alive to the supervisor."""
+        now = time.time()
+        if os.getppid() != self._master_pid:
+            # the master is gone, e.g. its reloaded image failed to start
+            logging.error(f'Master process {self._master_pid} exited, '
+                          f'stopping worker {self.worker_index}.')
+            asyncio.get_event_loop().stop()
+            return
+        self._date = _date_header()
+        if self.health.beat(self.worker_index, self._pid, self._connections):
+            self._flush_stats()
+        if self._docroot_refresh is None and self.docroot.needs_check():
+            self._refresh_docroot()
+        asyncio.get_event_loop().call_later(1 - now % 1, self._tick)
+
+    def _flush_stats(self):
+        self.stats.add(self.worker_index, self._stats, self.file_cache.hits,
+                       self.file_cache.misses)
+        self._stats.reset()
+
+    def _status(self):
+        """Status of all workers, counters of the others are up to a
+        second old."""
+        if self.health.get(self.worker_index, 'pid') == self._pid:
+            self._flush_stats()
+        return render_status(self.health, self.stats)
+
+    def _refresh_docroot(self):
+        try:
+            future = self.io_executor.run(self.docroot.refresh)
+        except ServerBusyError:
+            # file I/O of requests goes first, checked again next second
+            return
+        self._docroot_refresh = asyncio.ensure_future(future)
+        self._docroot_refresh.add_done_callback(self._on_docroot_refresh)
+
+    def _on_docroot_refresh(self, future):
+        self._docroot_refresh = None
+        if not future.cancelled() and future.exception() is not None:
+            logging.error('Error on refreshing document root index: %s',
+                          future.exception())
+
+    def _base_headers(self, keep_alive):
+        return self._date + self._connection_headers[keep_alive]
+
+    async def _create_get_or_head_response(self, document_path, headers,
+                                           request_headers, method):
+        """Returns response code, headers, info of the requested file and
+        the inclusive byte range of it to send, if only a part is sent."""
+        full_path = self.docroot.resolve(document_path)
+        info = await self.file_cache.get(full_path) if full_path else None
+        if info is None:
+            return (HttpCode.NOT_FOUND, headers + PLAIN_TEXT_EMPTY_CONTENT,
+                    None, None)
+        encoded_info = None
+        if 'range' not in request_headers:
+            # ranges are served from the identity representation only
+            encoded_info = await self._negotiate_encoding(
+                info, request_headers, document_path)
+        varies = encoded_info is not None or is_compressible(info.content_type)
+        if self.gzip and varies:
+            headers = headers + VARY_HEADER
+        if encoded_info is not None:
+            info = encoded_info
+        if _is_not_modified(info, request_headers):
+            return (HttpCode.NOT_MODIFIED, headers + info.validators, info,
+                    None)
+        if encoded_info is not None:
+            return HttpCode.OK, headers + info.headers, info, None
+        try:
+            byte_range = (_requested_range(info, request_headers)
+                          if method == 'GET' else None)
+        except RangeNotSatisfiableError:
+            content_range = f'Content-Range: bytes */{info.size}\r\n'
+            headers += content_range.encode() + PLAIN_TEXT_EMPTY_CONTENT
+            return HttpCode.RANGE_NOT_SATISFIABLE, headers, info, None
+        if byte_range is None:
+            return HttpCode.OK, headers + info.headers, info, None
+        start, end = byte_range
+        return HttpCode.PARTIAL_CONTENT, headers + (
+            f'Content-Length: {end - start + 1}\r\n'
+            f'Content-Type: {info.content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{info.size}\r\n'
+        ).encode() + info.validators, info, byte_range
+
+    async def _negotiate_encoding(self, info, request_headers,
+                                  document_path):
+        """Returns info of the gzip encoded file representation if client
+        accepts it: a precompressed .gz sibling file when present or file
+        contents compressed on the fly, if its type is worth compressing."""
+        if not self.gzip or not accepts_gzip(
+                request_headers.get('accept-encoding', '')):
+            return None
+        sibling_path = self.docroot.resolve(document_path + GZIP_SUFFIX)
+        sibling = (await self.file_cache.get(sibling_path)
+                   if sibling_path else None)
+        if sibling is not None:
+            return gzip_variant(info, sibling.size, sibling.content,
+                                sibling.path, sibling.etag)
+        if not is_compressible(info.content_type):
+            return None
+        size = info.size
+        if not MIN_COMPRESSED_FILE_SIZE <= size <= MAX_COMPRESSED_FILE_SIZE:
+            return None
+        compressed = await self.compressed_cache.get(info)
+        return gzip_variant(info, len(compressed), compressed)
+
+    async def _send_file(self, file, client_writer, offset=0, count=None):
+        """Sends file contents with sendfile(2): by the loop where it
+        supports it and straight to the socket of the connection otherwise,
+        falling back to reading it chunk by chunk in the executor."""
+        loop = asyncio.get_event_loop()
+        if self._sendfile_supported and hasattr(loop, 'sendfile'):
+            try:
+                await loop.sendfile(client_writer.transport, file, offset,
+                                    count)
+                return
+            except NotImplementedError:
+                # e.g. uvloop, nothing is sent in this case
+                self._sendfile_supported = False
+        sock = client_writer.get_extra_info('socket')
+        if hasattr(os, 'sendfile') and sock is not None:
+            await self._send_file_to_socket(file, client_writer, sock,
+                                            offset, count)
+            return
+        if not self._chunked_send_logged:
+            self._chunked_send_logged = True
+            logging.warning('sendfile(2) is not available, files are read '
+                            'in chunks in the I/O thread pool.')
+        await client_writer.drain()
+        file.seek(offset)
+        remaining = count
+        while remaining is None or remaining > 0:
+            size = (FILE_CHUNK_SIZE if remaining is None
+                    else min(FILE_CHUNK_SIZE, remaining))
+            chunk = await self.io_executor.run(file.read, size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            client_writer.write(chunk)
             await client_writer.drain()
 
-    def _tokenize_request(self, raw_request):
-        if not raw_request:
-            raise Exception('Error on reading request data, no data was read')
-        decoded_request = raw_request.decode('utf-8')
-        lines = decoded_request.split(RESPONSE_LINE_ENDING)
-        request_line, header_lines = lines[0], lines[1:]
-        request_args = request_line.split()
-        if len(request_args) < 2:
-            raise BadRequestError('Cannot tokenize request line: %s' % request_line)
-        method, resource = request_args[:2]
-        headers = _parse_headers(header_lines)
-        is_closing = headers.get('Connection', 'close') == 'close'
-        date_string = format_date_time(mktime(datetime.now().timetuple()))
-        connection = 'close' if is_closing else 'keep-alive'
-        response_headers = [
-            f'Date: {date_string}',
-            'Server: DIY HTTP Server',
-            f'Connection: {connection}'
-        ]
-        return method, resource, response_headers
-
-    def _create_get_or_head_response(self, document_path, headers):
-        full_path = os.path.join(self.root, document_path)
-        exists = os.path.exists(full_path)
-        escaped = exists and '/..' in full_path
-        absent_index = not exists and document_path.endswith('index.html')
-        if escaped:
-            return HttpCode.FORBIDDEN, headers + PLAIN_TEXT_EMPTY_CONTENT
-        if not exists or absent_index:
-            return HttpCode.NOT_FOUND, headers + PLAIN_TEXT_EMPTY_CONTENT
-
-        path = os.path.join(self.root, document_path)
-        content_length = os.path.getsize(path)
-        content_type = mimetypes.guess_type(request.pathname2url(path))[0]
-        headers.extend([
-            f'Content-Length: {content_length}',
-            f'Content-Type: {content_type}'
-        ])
-        return HttpCode.OK, headers
-
-    def _read_data(self, file):
+    async def _send_file_to_socket(self, file, client_writer, sock, offset,
+                                   count):
+        """sendfile(2) for loops without loop.sendfile (uvloop, Python
+        3.6). Loops refuse to watch a descriptor owned by a transport, so
+        writability is awaited on a duplicate of it."""
         loop = asyncio.get_event_loop()
-        return loop.run_in_executor(None, file.read)
+        transport = client_writer.transport
+        if transport.get_write_buffer_size():
+            # bytes buffered by the transport have to go out first
+            transport.set_write_buffer_limits(high=0)
+            try:
+                await client_writer.drain()
+            finally:
+                transport.set_write_buffer_limits(self.write_buffer_size)
+        if count is None:
+            count = os.fstat(file.fileno()).st_size - offset
+        fd = os.dup(sock.fileno())
+        try:
+            while count > 0:
+                try:
+                    sent = os.sendfile(fd, file.fileno(), offset, count)
+                except BlockingIOError:
+                    await _writable(loop, fd)
+                    continue
+                if not sent:
+                    # file was truncated
+                    break
+                offset += sent
+                count -= sent
+        finally:
+            os.close(fd)
 
 
 if __name__ == "__main__":
@@ -224,10 +876,63 @@ if __name__ == "__main__":
     parser.add_option("-r", "--root", action="store", type=str, default='.')
     parser.add_option("-l", "--logfile", action="store", type=str,
                       default='/tmp/httpd.log')
+    parser.add_option("-k", "--keep-alive-timeout", action="store",
+                      type=float, default=KEEP_ALIVE_TIMEOUT_SECONDS)
+    parser.add_option("-m", "--max-keep-alive-requests", action="store",
+                      type=int, default=MAX_KEEP_ALIVE_REQUESTS)
+    parser.add_option("-c", "--cache-check-interval", action="store",
+                      type=float, default=CHECK_INTERVAL_SECONDS)
+    parser.add_option("-s", "--max-cached-file-size", action="store",
+                      type=int, default=MAX_CACHED_FILE_SIZE)
+    parser.add_option("--no-gzip", action="store_false", dest="gzip",
+                      default=True)
+    parser.add_option("--reuse-port", action="store_true", default=False)
+    parser.add_option("--cpu-affinity", action="store_true", default=False)
+    parser.add_option("--max-header-size", action="store", type=int,
+                      default=MAX_HEADER_SIZE)
+    parser.add_option("--max-body-size", action="store", type=int,
+                      default=MAX_BODY_SIZE)
+    parser.add_option("-a", "--access-log", action="store", type=str,
+                      default='/tmp/httpd-access.log')
+    parser.add_option("--access-log-format", action="store", type="choice",
+                      choices=list(LOG_FORMATS), default='combined')
+    parser.add_option("--access-log-sample-rate", action="store",
+                      type=float, default=1.0)
+    parser.add_option("--max-connections", action="store", type=int,
+                      default=MAX_CONNECTIONS)
+    parser.add_option("--io-threads", action="store", type=int,
+                      default=IO_THREADS)
+    parser.add_option("--max-io-queue-size", action="store", type=int,
+                      default=MAX_IO_QUEUE_SIZE)
+    parser.add_option("--write-buffer-size", action="store", type=int,
+                      default=WRITE_BUFFER_SIZE)
+    parser.add_option("-g", "--graceful-timeout", action="store",
+                      type=float, default=GRACEFUL_TIMEOUT_SECONDS)
+    parser.add_option("--heartbeat-timeout", action="store", type=float,
+                      default=HEARTBEAT_TIMEOUT_SECONDS)
+    parser.add_option("--loop", action="store", type="choice",
+                      choices=list(LOOPS), default='auto')
+    parser.add_option("--status-path", action="store", type=str,
+                      default=STATUS_PATH)
+    parser.add_option("-t", "--request-timeout", action="store", type=float,
+                      default=REQUEST_TIMEOUT_SECONDS)
     (opts, args) = parser.parse_args()
     logfile = opts.logfile
     logging.basicConfig(filename=logfile, level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s',
                         datefmt='%Y.%m.%d %H:%M:%S')
-    server = DIYHTTPServer('127.0.0.1', 80, opts.root, opts.workers)
+    server = DIYHTTPServer('127.0.0.1', 80, opts.root, opts.workers,
+                           opts.keep_alive_timeout,
+                           opts.max_keep_alive_requests,
+                           opts.cache_check_interval,
+                           opts.max_cached_file_size, opts.gzip,
+                           opts.reuse_port, opts.cpu_affinity,
+                           opts.max_header_size, opts.max_body_size,
+                           opts.request_timeout, opts.access_log or None,
+                           opts.access_log_format,
+                           opts.access_log_sample_rate,
+                           opts.max_connections, opts.io_threads,
+                           opts.max_io_queue_size, opts.write_buffer_size,
+                           opts.graceful_timeout, opts.heartbeat_timeout,
+                           opts.loop, opts.status_path or None)
     server.start()
@@ -0,0 +1,180 @@
+from collections import namedtuple
+
+HEAD_ENDING = b'\r\n\r\n'
+LINE_ENDING = b'\r\n'
+MAX_REQUEST_LINE_SIZE = 8 * 1024
+MAX_HEADER_SIZE = 32 * 1024
+MAX_HEADERS_COUNT = 100
+MAX_BODY_SIZE = 1024 * 1024
+DEFAULT_HTTP_VERSION = 'HTTP/1.0'
+# bytes that can't be a part of a header name, RFC 7230 token
+_NON_TOKEN_BYTES = b' \t"(),/:;<=>?@[\\]{}'
+
+
+class ParseError(Exception):
+    """Request is malformed and can't be parsed."""
+    pass
+
+
+class RequestLineTooLongError(ParseError):
+    """Request line is longer than allowed."""
+    pass
+
+
+class HeadersTooLargeError(ParseError):
+    """Request line and headers together are larger than allowed."""
+    pass
+
+
+class BodyTooLargeError(ParseError):
+    """Content-Length of the request is larger than allowed."""
+    pass
+
+
+class UnsupportedTransferEncodingError(ParseError):
+    """Request body is sent with a transfer coding, only Content-Length
+    delimited bodies are supported."""
+    pass
+
+
+class Request(namedtuple('Request', [
+        'method', 'resource', 'version', 'headers', 'body'])):
+    """Parsed request, headers maps lower cased names to stripped values."""
+    __slots__ = ()
+
+
+def _parse_request_line(line):
+    parts = line.split()
+    if len(parts) not in (2, 3):
+        raise ParseError(f'Cannot tokenize request line: {line!r}')
+    try:
+        method = parts[0].decode('ascii')
+        resource = parts[1].decode('utf-8')
+        version = (parts[2].decode('ascii') if len(parts) == 3
+                   else DEFAULT_HTTP_VERSION)
+    except UnicodeDecodeError:
+        raise ParseError(f'Cannot decode request line: {line!r}')
+    if not version.startswith('HTTP/'):
+        raise ParseError(f'Unknown protocol version: {version}')
+    return method, resource, version
+
+
+def _parse_header_lines(lines, max_headers):
+    if len(lines) > max_headers:
+        raise HeadersTooLargeError(f'More than {max_headers} headers')
+    headers = {}
+    for line in lines:
+        if line[:1] in (b' ', b'\t'):
+            # obsolete line folding is rejected as RFC 7230 allows
+            raise ParseError(f'Folded header line: {line!r}')
+        name, colon, value = line.partition(b':')
+        if not colon or not name or any(
+                byte in _NON_TOKEN_BYTES for byte in name):
+            raise ParseError(f'Malformed header line: {line!r}')
+        # names are tokens, values are opaque and decoded as latin-1
+        name = name.decode('ascii').lower()
+        value = value.strip(b' \t').decode('latin-1')
+        if name in headers:
+            headers[name] = headers[name] + ', ' + value
+        else:
+            headers[name] = value
+    return headers
+
+
+def _body_size(headers, max_body_size):
+    if 'transfer-encoding' in headers:
+        raise UnsupportedTransferEncodingError(headers['transfer-encoding'])
+    content_length = headers.get('content-length')
+    if content_length is None:
+        return 0
+    if not content_length.isdigit():
+        raise ParseError(f'Invalid Content-Length: {content_length}')
+    size = int(content_length)
+    if size > max_body_size:
+        raise BodyTooLargeError(f'Content-Length {size} is over '
+                                f'{max_body_size}')
+    return size
+
+
+class RequestParser(object):
+    """Incremental parser of requests sent over one connection.
+
+    Received bytes are fed in as they arrive and complete requests are
+    taken out with next_request, bytes of the following request stay
+    buffered. The head of a request is searched for in raw bytes and
+    buffering stops with an error once it grows over the limits, so a
+    client can't make the server hold an unbounded amount of data.
+    """
+
+    def __init__(self, max_request_line_size=MAX_REQUEST_LINE_SIZE,
+                 max_header_size=MAX_HEADER_SIZE,
+                 max_headers_count=MAX_HEADERS_COUNT,
+                 max_body_size=MAX_BODY_SIZE):
+        self.max_request_line_size = max_request_line_size
+        self.max_header_size = max_header_size
+        self.max_headers_count = max_headers_count
+        self.max_body_size = max_body_size
+        self._buffer = bytearray()
+        # offset the search of the head ending is resumed from
+        self._scanned = 0
+        self._head = None
+        self._body_size = 0
+
+    @property
+    def has_pending_data(self):
+        """Whether a part of the next request is already received."""
+        return bool(self._buffer) or self._head is not None
+
+    def feed(self, data):
+        self._buffer += data
+
+    def next_request(self):
+        """Returns the next complete Request or None if more data is
+        needed, raises ParseError subclasses on malformed requests."""
+        if self._head is None and not self._parse_head():
+            return None
+        if len(self._buffer) < self._body_size:
+            return None
+        body = bytes(self._buffer[:self._body_size])
+        del self._buffer[:self._body_size]
+        method, resource, version, headers = self._head
+        self._head = None
+        self._body_size = 0
+        return Request(method, resource, version, headers, body)
+
+    def _parse_head(self):
+        if not self._scanned:
+            # empty lines before a request line are ignored, RFC 7230 3.5
+            while self._buffer.startswith(LINE_ENDING):
+                del self._buffer[:len(LINE_ENDING)]
+        end = self._buffer.find(HEAD_ENDING, self._scanned)
+        if end < 0:
+            self._check_incomplete_head()
+            self._scanned = max(len(self._buffer) - len(HEAD_ENDING) + 1, 0)
+            return False
+        if end + len(HEAD_ENDING) > self.max_header_size:
+            raise HeadersTooLargeError(f'Request head is over '
+                                       f'{self.max_header_size} bytes')
+        lines = bytes(self._buffer[:end]).split(LINE_ENDING)
+        del self._buffer[:end + len(HEAD_ENDING)]
+        self._scanned = 0
+        if len(lines[0]) > self.max_request_line_size:
+            raise RequestLineTooLongError(f'Request line is over '
+                                          f'{self.max_request_line_size} '
+                                          f'bytes')
+        method, resource, version = _parse_request_line(lines[0])
+        headers = _parse_header_lines(lines[1:], self.max_headers_count)
+        self._body_size = _body_size(headers, self.max_body_size)
+        self._head = method, resource, version, headers
+        return True
+
+    def _check_incomplete_head(self):
+        line_end = self._buffer.find(LINE_ENDING, 0,
+                                     self.max_request_line_size + 1)
+        if line_end < 0 and len(self._buffer) > self.max_request_line_size:
+            raise RequestLineTooLongError(f'Request line is over '
+                                          f'{self.max_request_line_size} '
+                                          f'bytes')
+        if len(self._buffer) >= self.max_header_size:
+            raise HeadersTooLargeError(f'Request head is over '
+                                       f'{self.max_header_size} bytes')
@@ -0,0 +1,98 @@
+import json
+import multiprocessing
+import time
+
+from bisect import bisect_left
+
+# upper bounds of latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+LATENCY_BUCKET_NAMES = tuple(
+    [f'le_{bound}ms' for bound in LATENCY_BUCKETS_MS] + ['over'])
+_LATENCY_BOUNDS = tuple(bound / 1000 for bound in LATENCY_BUCKETS_MS)
+
+
+class WorkerStats(object):
+    """Counters of requests served by a worker since the last flush.
+
+    Recording a request only increments plain attributes, so it costs next
+    to nothing; counters are added to the shared StatsTable and reset once
+    a second.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.bytes_sent = 0
+        self.latency = [0] * len(LATENCY_BUCKET_NAMES)
+
+    def record(self, bytes_sent, request_time):
+        self.requests += 1
+        self.bytes_sent += bytes_sent
+        self.latency[bisect_left(_LATENCY_BOUNDS, request_time)] += 1
+
+
+class StatsTable(object):
+    """Shared memory table of request counters, one row per worker index.
+
+    Workers add their counters to their own row, the row of a worker index
+    keeps counting across restarts of the worker. Cache hits and misses are
+    absolute values of the current worker process.
+    """
+    FIELDS = ('requests', 'bytes_sent', 'cache_hits',
+              'cache_misses') + LATENCY_BUCKET_NAMES
+
+    def __init__(self, size):
+        self.size = size
+        self._values = multiprocessing.RawArray('d', size * len(self.FIELDS))
+
+    def add(self, index, stats, cache_hits, cache_misses):
+        offset = index * len(self.FIELDS)
+        values = self._values
+        values[offset] += stats.requests
+        values[offset + 1] += stats.bytes_sent
+        values[offset + 2] = cache_hits
+        values[offset + 3] = cache_misses
+        for bucket, count in enumerate(stats.latency, offset + 4):
+            values[bucket] += count
+
+    def row(self, index):
+        offset = index * len(self.FIELDS)
+        return dict(zip(self.FIELDS,
+                        self._values[offset:offset + len(self.FIELDS)]))
+
+
+def _cache_hit_ratio(hits, misses):
+    lookups = hits + misses
+    return round(hits / lookups, 4) if lookups else None
+
+
+def render_status(health, stats):
+    """JSON document with health and counters of every worker and their
+    totals."""
+    workers = []
+    total = dict.fromkeys(('connections', 'requests', 'bytes_sent',
+                           'cache_hits', 'cache_misses'), 0)
+    total_latency = [0] * len(LATENCY_BUCKET_NAMES)
+    for row in health.rows():
+        counters = stats.row(row['worker'])
+        latency = [int(counters[name]) for name in LATENCY_BUCKET_NAMES]
+        row.update({
+            'requests': int(counters['requests']),
+            'bytes_sent': int(counters['bytes_sent']),
+            'cache_hits': int(counters['cache_hits']),
+            'cache_misses': int(counters['cache_misses']),
+            'cache_hit_ratio': _cache_hit_ratio(counters['cache_hits'],
+                                                counters['cache_misses']),
+            'latency': dict(zip(LATENCY_BUCKET_NAMES, latency)),
+        })
+        for name in total:
+            total[name] += row[name]
+        total_latency = [a + b for a, b in zip(total_latency, latency)]
+        workers.append(row)
+    total['cache_hit_ratio'] = _cache_hit_ratio(total['cache_hits'],
+                                                total['cache_misses'])
+    total['latency'] = dict(zip(LATENCY_BUCKET_NAMES, total_latency))
+    return json.dumps({'time': time.time(), 'total': total,
+                       'workers': workers}, indent=2).encode()
@@ -0,0 +1,375 @@
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from collections import namedtuple
+from multiprocessing.connection import wait
+
+HEARTBEAT_TIMEOUT_SECONDS = 10
+READY_TIMEOUT_SECONDS = 10
+GRACEFUL_TIMEOUT_SECONDS = 10
+# workers exiting sooner after start are respawned with a delay, so a
+# worker failing on start doesn't turn into a fork loop
+MIN_UPTIME_SECONDS = 1
+RESPAWN_DELAY_SECONDS = 1
+CHECK_INTERVAL_SECONDS = 1
+
+STARTING, READY, STOPPED = 0, 1, 2
+STATE_NAMES = {STARTING: 'starting', READY: 'ready', STOPPED: 'stopped'}
+# the master re-executes itself on reload, passing its workers and listening
+# socket to the new image in these environment variables
+WORKERS_ENV = 'DIY_HTTPD_WORKERS'
+RETIRING_ENV = 'DIY_HTTPD_RETIRING'
+LISTEN_FD_ENV = 'DIY_HTTPD_LISTEN_FD'
+MASTER_SIGNALS = {signal.SIGINT, signal.SIGTERM, signal.SIGHUP,
+                  signal.SIGUSR1}
+
+
+class Handover(namedtuple('Handover', ['workers', 'retiring'])):
+    """Workers left running by the previous master image: index -> pid of
+    the serving ones and pids of the ones already stopping."""
+    __slots__ = ()
+
+    def to_environ(self, environ):
+        environ[WORKERS_ENV] = ','.join(
+            f'{index}:{pid}' for index, pid in sorted(self.workers.items()))
+        environ[RETIRING_ENV] = ','.join(str(pid) for pid in self.retiring)
+
+    @classmethod
+    def from_environ(cls, environ):
+        """Takes the handover out of environ, so that workers and later
+        reloads don't see it, returns None on a fresh start."""
+        workers = environ.pop(WORKERS_ENV, None)
+        retiring = environ.pop(RETIRING_ENV, '')
+        if workers is None:
+            return None
+        pairs = [item.split(':') for item in workers.split(',') if item]
+        return cls({int(index): int(pid) for index, pid in pairs},
+                   [int(pid) for pid in retiring.split(',') if pid])
+
+
+def reexec(handover, listen_fd=None):
+    """Replaces the master process image with a fresh start of the same
+    command line, so new code and options are loaded. The pid stays the
+    same, so running workers remain its children and are handed over along
+    with the listening socket."""
+    environ = dict(os.environ)
+    handover.to_environ(environ)
+    if listen_fd is not None:
+        os.set_inheritable(listen_fd, True)
+        environ[LISTEN_FD_ENV] = str(listen_fd)
+    if hasattr(sys, 'orig_argv'):
+        argv = [sys.executable] + sys.orig_argv[1:]
+    else:
+        argv = [sys.executable] + sys.argv
+    logging.info('Re-executing master: %s', ' '.join(argv))
+    os.execve(sys.executable, argv, environ)
+
+
+class _AdoptedWorker(object):
+    """Worker started by the previous master image, known by pid only."""
+    sentinel = None
+    exitcode = None
+
+    def __init__(self, pid):
+        self.pid = pid
+
+    def poll(self):
+        """Reaps the worker if it exited, returns whether it did."""
+        try:
+            pid, _ = os.waitpid(self.pid, os.WNOHANG)
+        except ChildProcessError:
+            return True
+        return pid != 0
+
+    def join(self):
+        pass
+
+
+class HealthTable(object):
+    """Shared memory table of worker health, one row per worker index.
+
+    The supervisor claims a row for every worker it starts, the worker then
+    reports a heartbeat along with its open connections once a second. Rows
+    are only updated by the worker that owns them, so a worker being
+    replaced on reload doesn't overwrite the row of its successor.
+    """
+    FIELDS = ('pid', 'state', 'started_at', 'heartbeat', 'connections',
+              'restarts')
+
+    def __init__(self, size):
+        self.size = size
+        self._offsets = {field: offset for offset, field
+                         in enumerate(self.FIELDS)}
+        self._values = multiprocessing.RawArray('d', size * len(self.FIELDS))
+
+    def get(self, index, field):
+        return self._values[index * len(self.FIELDS) + self._offsets[field]]
+
+    def set(self, index, field, value):
+        self._values[index * len(self.FIELDS) + self._offsets[field]] = value
+
+    def claim(self, index, pid):
+        now = time.time()
+        self.set(index, 'pid', pid)
+        self.set(index, 'state', STARTING)
+        self.set(index, 'started_at', now)
+        self.set(index, 'heartbeat', now)
+        self.set(index, 'connections', 0)
+
+    def beat(self, index, pid, connections):
+        """Reports the worker is alive, ignored if the row was claimed by
+        another worker."""
+        if self.get(index, 'pid') != pid:
+            return False
+        self.set(index, 'heartbeat', time.time())
+        self.set(index, 'connections', connections)
+        self.set(index, 'state', READY)
+        return True
+
+    def rows(self):
+        now = time.time()
+        rows = []
+        for index in range(self.size):
+            row = {field: self.get(index, field) for field in self.FIELDS}
+            rows.append({
+                'worker': index,
+                'pid': int(row['pid']),
+                'state': STATE_NAMES.get(int(row['state']), 'unknown'),
+                'uptime': round(now - row['started_at'], 1),
+                'heartbeat_age': round(now - row['heartbeat'], 1),
+                'connections': int(row['connections']),
+                'restarts': int(row['restarts']),
+            })
+        return rows
+
+
+class Supervisor(object):
+    """Keeps worker_count worker processes running.
+
+    Workers that exit or stop sending heartbeats are replaced. On SIGHUP run
+    returns a Handover of the running workers for the master to re-execute
+    itself with. The supervisor of the new image adopts them: a new worker
+    is started for every index and the old one is asked to stop with SIGTERM
+    once its successor is ready, so the capacity doesn't drop while old
+    workers finish their connections. SIGTERM and SIGINT stop all workers
+    gracefully, SIGUSR1 logs the health table.
+    """
+
+    def __init__(self, target, worker_count, health,
+                 heartbeat_timeout=HEARTBEAT_TIMEOUT_SECONDS,
+                 ready_timeout=READY_TIMEOUT_SECONDS,
+                 graceful_timeout=GRACEFUL_TIMEOUT_SECONDS, handover=None):
+        # called with the worker index in a forked process
+        self.target = target
+        self.worker_count = worker_count
+        self.health = health
+        self.heartbeat_timeout = heartbeat_timeout
+        self.ready_timeout = ready_timeout
+        self.graceful_timeout = graceful_timeout
+        self.handover = handover
+        self._workers = {}
+        # index -> old worker to stop once the new one is ready
+        self._replaced = {}
+        self._retiring = set()
+        self._respawn_at = {}
+        self._stop_deadline = None
+        self._reload_requested = False
+        self._adopted = {}
+
+    def run(self):
+        """Supervises workers until they are stopped, returns a Handover
+        if a reload was requested and None otherwise."""
+        wakeup_read, wakeup_write = os.pipe()
+        os.set_blocking(wakeup_read, False)
+        os.set_blocking(wakeup_write, False)
+        # signal handlers only set flags, the wakeup fd interrupts waiting
+        previous_wakeup_fd = signal.set_wakeup_fd(wakeup_write)
+        signal.signal(signal.SIGINT, self._on_stop)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGUSR1, self._on_health)
+        try:
+            self._adopt()
+            # signals are blocked across the re-execution of the master
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, MASTER_SIGNALS)
+            for index in range(self.worker_count):
+                if self._stop_deadline is None:
+                    self._spawn(index)
+            self._replace_adopted()
+            while self._stop_deadline is None or self._processes():
+                self._wait(wakeup_read)
+                if self._stop_deadline is not None:
+                    self._kill_overdue()
+                    continue
+                if self._reload_requested:
+                    return self._hand_over()
+                self._retire_replaced()
+                self._check_heartbeats()
+                self._respawn_due()
+        finally:
+            signal.set_wakeup_fd(previous_wakeup_fd)
+            os.close(wakeup_read)
+            os.close(wakeup_write)
+
+    def _processes(self):
+        replaced = [old for old, _ in self._replaced.values()]
+        return list(self._workers.values()) + replaced + list(self._retiring)
+
+    def _wait(self, wakeup_read):
+        timeout = CHECK_INTERVAL_SECONDS
+        if self._respawn_at:
+            timeout = max(min(min(self._respawn_at.values()) - time.time(),
+                              timeout), 0)
+        processes = self._processes()
+        sentinels = {process.sentinel: process for process in processes
+                     if process.sentinel is not None}
+        for ready in wait(list(sentinels) + [wakeup_read], timeout):
+            if ready == wakeup_read:
+                try:
+                    os.read(wakeup_read, 512)
+                except BlockingIOError:
+                    pass
+            else:
+                self._on_exit(sentinels[ready])
+        for process in processes:
+            # adopted workers have no sentinel and are polled instead
+            if process.sentinel is None and process.poll():
+                self._on_exit(process)
+
+    def _spawn(self, index):
+        process = multiprocessing.Process(target=self.target, args=(index,))
+        process.daemon = True
+        process.start()
+        self.health.claim(index, process.pid)
+        self._workers[index] = process
+        logging.info(f'Started worker {index} (pid {process.pid}).')
+        return process
+
+    def _on_exit(self, process):
+        process.join()
+        if process in self._retiring:
+            self._retiring.discard(process)
+            logging.info(f'Retired worker (pid {process.pid}) exited.')
+            return
+        for index, (old, _) in list(self._replaced.items()):
+            if old is process:
+                # exited before its successor was ready
+                del self._replaced[index]
+                return
+        index = next(index for index, worker in self._workers.items()
+                     if worker is process)
+        del self._workers[index]
+        self.health.set(index, 'state', STOPPED)
+        if self._stop_deadline is not None:
+            return
+        uptime = time.time() - self.health.get(index, 'started_at')
+        logging.error(f'Worker {index} (pid {process.pid}) exited with code '
+                      f'{process.exitcode} after {uptime:.1f} s, '
+                      f'respawning.')
+        self.health.set(index, 'restarts',
+                        self.health.get(index, 'restarts') + 1)
+        delay = RESPAWN_DELAY_SECONDS if uptime < MIN_UPTIME_SECONDS else 0
+        self._respawn_at[index] = time.time() + delay
+
+    def _respawn_due(self):
+        now = time.time()
+        for index, respawn_at in list(self._respawn_at.items()):
+            if respawn_at <= now:
+                del self._respawn_at[index]
+                self._spawn(index)
+
+    def _adopt(self):
+        if self.handover is None:
+            return
+        logging.info(f'Adopting workers {self.handover.workers} and '
+                     f'stopping ones {self.handover.retiring}.')
+        for pid in self.handover.retiring:
+            self._retiring.add(_AdoptedWorker(pid))
+        self._adopted = {index: _AdoptedWorker(pid)
+                         for index, pid in self.handover.workers.items()}
+
+    def _replace_adopted(self):
+        deadline = time.time() + self.ready_timeout
+        for index, old in self._adopted.items():
+            if index in self._workers and self._stop_deadline is None:
+                self._replaced[index] = old, deadline
+            else:
+                # worker count was lowered or a stop is in progress
+                self._stop(old)
+        self._adopted = {}
+
+    def _hand_over(self):
+        logging.info('Reloading master and workers.')
+        # pending signals are delivered to the new image
+        signal.pthread_sigmask(signal.SIG_BLOCK, MASTER_SIGNALS)
+        for old, _ in self._replaced.values():
+            # replaced again before the previous reload finished
+            self._stop(old)
+        workers = {index: process.pid
+                   for index, process in self._workers.items()}
+        retiring = [process.pid for process in self._retiring]
+        return Handover(workers, retiring)
+
+    def _retire_replaced(self):
+        now = time.time()
+        for index, (old, deadline) in list(self._replaced.items()):
+            new = self._workers.get(index)
+            if new is None or deadline <= now or self._is_ready(index, new):
+                del self._replaced[index]
+                self._stop(old)
+
+    def _is_ready(self, index, process):
+        owned = self.health.get(index, 'pid') == process.pid
+        return owned and self.health.get(index, 'state') == READY
+
+    def _stop(self, process):
+        """Asks a worker to finish its connections and exit."""
+        self._retiring.add(process)
+        self._signal(process, signal.SIGTERM)
+
+    def _check_heartbeats(self):
+        now = time.time()
+        for index, process in self._workers.items():
+            state = self.health.get(index, 'state')
+            age = now - self.health.get(index, 'heartbeat')
+            timeout = (self.heartbeat_timeout if state == READY
+                       else self.ready_timeout)
+            if state in (READY, STARTING) and age > timeout:
+                logging.error(f'Worker {index} (pid {process.pid}) is not '
+                              f'responding for {age:.1f} s, killing it.')
+                self._signal(process, signal.SIGKILL)
+
+    def _kill_overdue(self):
+        if time.time() < self._stop_deadline:
+            return
+        for process in self._processes():
+            logging.warning(f'Worker (pid {process.pid}) did not stop in '
+                            f'time, killing it.')
+            self._signal(process, signal.SIGKILL)
+
+    @staticmethod
+    def _signal(process, signum):
+        try:
+            os.kill(process.pid, signum)
+        except ProcessLookupError:
+            pass
+
+    def _on_stop(self, unused_signum, unused_frame):
+        if self._stop_deadline is not None:
+            return
+        logging.info('Termination request received, shutting down workers.')
+        self._stop_deadline = time.time() + self.graceful_timeout + 1
+        self._respawn_at.clear()
+        for process in self._processes():
+            self._signal(process, signal.SIGTERM)
+
+    def _on_reload(self, unused_signum, unused_frame):
+        self._reload_requested = True
+
+    def _on_health(self, unused_signum, unused_frame):
+        for row in self.health.rows():
+            logging.info('Worker health: %s', row)
@@ -0,0 +1,24 @@
+import unittest
+
+from compression import accepts_gzip
+
+
+class AcceptsGzipTests(unittest.TestCase):
+
+    def test_gzip_is_accepted(self):
+        for header_value in ('gzip', 'GZIP', 'x-gzip', 'deflate, gzip',
+                             'gzip;q=0.5', 'br;q=1.0, gzip; q=0.1', '*',
+                             'gzip, *;q=0', 'deflate;q=0, *;q=0.2'):
+            with self.subTest(header_value=header_value):
+                self.assertTrue(accepts_gzip(header_value))
+
+    def test_gzip_is_not_accepted(self):
+        for header_value in ('', 'identity', 'deflate, br', 'gzip;q=0',
+                             'gzip;q=0.0, *', '*;q=0', 'gzip;q=abc',
+                             'gzipped'):
+            with self.subTest(header_value=header_value):
+                self.assertFalse(accepts_gzip(header_value))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+import asyncio
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from httpd import DIYHTTPServer, MAX_CACHED_FILE_SIZE
+
+RESPONSE_HEAD_ENDING = b'\r\n\r\n'
+TIMEOUT_SECONDS = 5
+FILES = {
+    'index.html': b'<html>index</html>',
+    'notes.txt': b'notes',
+    'page.html': b'<p>compressible</p>' * 256,
+    'style.css': b'p { margin: 0 }' * 64,
+    # precompressed sibling, served instead of compressing style.css
+    'style.css.gz': gzip.compress(b'/* precompressed */'),
+    # read from disk and sent with sendfile instead of served from memory
+    'large.bin': b'0123456789abcdef' * (MAX_CACHED_FILE_SIZE // 8),
+}
+
+
+class Response(object):
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+
+class ConnectionTestCase(unittest.TestCase):
+    """Runs the connection handler of a server on a temporary document root
+    in the test process and talks to it over a loopback socket."""
+
+    server_options = {}
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix='httpd-test-')
+        for name, content in FILES.items():
+            with open(os.path.join(self.root, name), 'wb') as file:
+                file.write(content)
+        self.server = DIYHTTPServer('127.0.0.1', 0, self.root, 1,
+                                    loop='asyncio', **self.server_options)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.listener = self.loop.run_until_complete(asyncio.start_server(
+            self.server._connection_handler, '127.0.0.1', 0))
+        self.port = self.listener.sockets[0].getsockname()[1]
+
+    def tearDown(self):
+        self.listener.close()
+        self.loop.run_until_complete(self.listener.wait_closed())
+        if self.server._connection_tasks:
+            self.loop.run_until_complete(
+                asyncio.wait(self.server._connection_tasks))
+        # lets closed transports release their sockets
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.server.io_executor._executor.shutdown()
+        self.loop.close()
+        asyncio.set_event_loop(None)
+        shutil.rmtree(self.root)
+
+    def run_client(self, coro):
+        return self.loop.run_until_complete(
+            asyncio.wait_for(coro, TIMEOUT_SECONDS))
+
+    def exchange(self, data, count):
+        """Sends data at once, returns count responses read from the
+        connection and whether the server closed it after them."""
+        async def client():
+            reader, writer = await asyncio.open_connection('127.0.0.1',
+                                                           self.port)
+            try:
+                writer.write(data)
+                responses = [await self.read_response(reader)
+                             for _ in range(count)]
+                closed = await self.is_closed(reader)
+            finally:
+                writer.close()
+            return responses, closed
+        return self.run_client(client())
+
+    async def read_response(self, reader):
+        head = await reader.readuntil(RESPONSE_HEAD_ENDING)
+        lines = head.decode('latin-1').split('\r\n')
+        status = int(lines[0].split()[1])
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        return Response(status, headers, await reader.readexactly(length))
+
+    def get(self, path, headers=b''):
+        responses, _ = self.exchange(
+            b'GET %s HTTP/1.1\r\nConnection: close\r\n%s\r\n'
+            % (path.encode(), headers), 1)
+        return responses[0]
+
+    async def is_closed(self, reader):
+        try:
+            await asyncio.wait_for(reader.read(1), 0.2)
+        except asyncio.TimeoutError:
+            return False
+        return reader.at_eof()
+
+
+class ConnectionTests(ConnectionTestCase):
+
+    def test_pipelined_requests_are_answered_in_order(self):
+        paths = ['/index.html', '/large.bin', '/missing.html', '/notes.txt',
+                 '/index.html']
+        data = b''.join(b'GET %s HTTP/1.1\r\nHost: localhost\r\n\r\n'
+                        % path.encode() for path in paths)
+        responses, closed = self.exchange(data, len(paths))
+        self.assertEqual([response.status for response in responses],
+                         [200, 200, 404, 200, 200])
+        self.assertEqual([response.body for response in responses],
+                         [FILES['index.html'], FILES['large.bin'], b'',
+                          FILES['notes.txt'], FILES['index.html']])
+        self.assertFalse(closed)
+
+    def test_connection_close_closes_connection(self):
+        responses, closed = self.exchange(
+            b'GET /notes.txt HTTP/1.1\r\nConnection: close\r\n\r\n'
+            b'GET /index.html HTTP/1.1\r\n\r\n', 1)
+        self.assertEqual(responses[0].body, FILES['notes.txt'])
+        self.assertEqual(responses[0].headers['connection'], 'close')
+        self.assertTrue(closed)
+
+    def test_http_1_0_closes_connection(self):
+        responses, closed = self.exchange(b'GET /notes.txt HTTP/1.0\r\n\r\n',
+                                          1)
+        self.assertEqual(responses[0].status, 200)
+        self.assertEqual(responses[0].headers['connection'], 'close')
+        self.assertTrue(closed)
+
+    def test_http_1_0_keep_alive_keeps_connection(self):
+        responses, closed = self.exchange(
+            b'GET /notes.txt HTTP/1.0\r\nConnection: keep-alive\r\n\r\n', 1)
+        self.assertEqual(responses[0].headers['connection'], 'keep-alive')
+        self.assertFalse(closed)
+
+    def test_full_io_executor_is_service_unavailable(self):
+        executor = self.server.io_executor
+        executor.pending = executor.max_queue_size
+        with self.assertLogs(level='WARNING'):
+            responses, closed = self.exchange(
+                b'GET /index.html HTTP/1.1\r\n\r\n'
+                b'GET /notes.txt HTTP/1.1\r\n\r\n', 1)
+        self.assertEqual(responses[0].status, 503)
+        self.assertEqual(responses[0].headers['retry-after'], '1')
+        self.assertTrue(closed)
+        executor.pending = 0
+
+
+class ConditionalRequestTests(ConnectionTestCase):
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.get('/notes.txt').headers['etag']
+        response = self.get('/notes.txt',
+                            b'If-None-Match: %s\r\n' % etag.encode())
+        self.assertEqual(response.status, 304)
+        self.assertEqual(response.headers['etag'], etag)
+        self.assertEqual(response.body, b'')
+
+    def test_unmodified_file_is_not_modified(self):
+        last_modified = self.get('/notes.txt').headers['last-modified']
+        response = self.get('/notes.txt', b'If-Modified-Since: %s\r\n'
+                            % last_modified.encode())
+        self.assertEqual(response.status, 304)
+
+    def test_range_of_cached_file(self):
+        response = self.get('/notes.txt', b'Range: bytes=1-3\r\n')
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.headers['content-range'], 'bytes 1-3/5')
+        self.assertEqual(response.body, b'ote')
+
+    def test_range_of_file_sent_from_disk(self):
+        response = self.get('/large.bin', b'Range: bytes=100-\r\n')
+        self.assertEqual(response.status, 206)
+        self.assertEqual(response.body, FILES['large.bin'][100:])
+
+    def test_range_is_ignored_for_changed_file(self):
+        response = self.get('/notes.txt', b'Range: bytes=1-3\r\n'
+                            b'If-Range: "changed"\r\n')
+        self.assertEqual(response.status, 200)
+        self.assertEqual(response.body, FILES['notes.txt'])
+
+    def test_range_past_end_is_not_satisfiable(self):
+        response = self.get('/notes.txt', b'Range: bytes=5-\r\n')
+        self.assertEqual(response.status, 416)
+        self.assertEqual(response.headers['content-range'], 'bytes */5')
+
+
+class GzipTests(ConnectionTestCase):
+
+    def test_compressible_file_is_compressed(self):
+        response = self.get('/page.html', b'Accept-Encoding: gzip\r\n')
+        self.assertEqual(response.headers['content-encoding'], 'gzip')
+        self.assertEqual(response.headers['vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.body), FILES['page.html'])
+
+    def test_identity_is_sent_without_gzip_accepted(self):
+        for accept_encoding in (b'', b'Accept-Encoding: gzip;q=0\r\n'):
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.get('/page.html', accept_encoding)
+                self.assertNotIn('content-encoding', response.headers)
+                self.assertEqual(response.headers['vary'],
+                                 'Accept-Encoding')
+                self.assertEqual(response.body, FILES['page.html'])
+
+    def test_precompressed_sibling_is_sent(self):
+        response = self.get('/style.css', b'Accept-Encoding: gzip\r\n')
+        self.assertEqual(response.headers['content-encoding'], 'gzip')
+        self.assertEqual(response.body, FILES['style.css.gz'])
+
+    def test_gzip_variant_has_own_etag(self):
+        identity = self.get('/page.html')
+        compressed = self.get('/page.html', b'Accept-Encoding: gzip\r\n')
+        self.assertNotEqual(identity.headers['etag'],
+                            compressed.headers['etag'])
+        response = self.get('/page.html', b'Accept-Encoding: gzip\r\n'
+                            b'If-None-Match: %s\r\n'
+                            % compressed.headers['etag'].encode())
+        self.assertEqual(response.status, 304)
+
+    def test_incompressible_file_is_not_compressed(self):
+        response = self.get('/large.bin', b'Accept-Encoding: gzip\r\n')
+        self.assertNotIn('content-encoding', response.headers)
+        self.assertEqual(response.body, FILES['large.bin'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+
+from wsgiref.handlers import format_date_time
+
+from file_cache import FileInfo
+from httpd import (RangeNotSatisfiableError, _etag_matches,
+                   _is_modified_since, _parse_range)
+
+MTIME_SECONDS = 1500000000
+
+
+def file_info(mtime=MTIME_SECONDS * 1000000000 + 500000000):
+    return FileInfo('/index.html', 100, mtime, 1, 'text/html', '"abc"',
+                    format_date_time(mtime // 1000000000), b'', b'', None)
+
+
+class RangeTests(unittest.TestCase):
+
+    def test_satisfiable_ranges(self):
+        for header_value, expected in (('bytes=0-9', (0, 9)),
+                                       ('bytes=90-', (90, 99)),
+                                       ('bytes=-10', (90, 99)),
+                                       ('bytes=-200', (0, 99)),
+                                       ('bytes=50-500', (50, 99)),
+                                       ('bytes=99-99', (99, 99)),
+                                       (' bytes = 1 - 2', (1, 2))):
+            with self.subTest(header_value=header_value):
+                self.assertEqual(_parse_range(header_value, 100), expected)
+
+    def test_unsupported_ranges_are_ignored(self):
+        for header_value in ('items=0-9', 'bytes=0-1,5-6', 'bytes=9-0',
+                             'bytes=a-b', 'bytes=-', 'bytes=5', 'bytes=',
+                             'bytes=+1-2'):
+            with self.subTest(header_value=header_value):
+                self.assertIsNone(_parse_range(header_value, 100))
+
+    def test_unsatisfiable_ranges(self):
+        for header_value, size in (('bytes=100-', 100), ('bytes=200-300', 100),
+                                   ('bytes=-0', 100), ('bytes=-5', 0),
+                                   ('bytes=0-', 0)):
+            with self.subTest(header_value=header_value, size=size):
+                with self.assertRaises(RangeNotSatisfiableError):
+                    _parse_range(header_value, size)
+
+
+class ConditionalRequestTests(unittest.TestCase):
+
+    def test_etag_matches(self):
+        for header_value in ('"abc"', 'W/"abc"', '"x", "abc"', ' "x",W/"abc" ',
+                             '*', ' * '):
+            with self.subTest(header_value=header_value):
+                self.assertTrue(_etag_matches('"abc"', header_value))
+
+    def test_etag_does_not_match(self):
+        for header_value in ('"x"', 'abc', '"ABC"', '', '"abc', 'W/"x", *x'):
+            with self.subTest(header_value=header_value):
+                self.assertFalse(_etag_matches('"abc"', header_value))
+
+    def test_not_modified_since_last_modified(self):
+        info = file_info()
+        self.assertFalse(_is_modified_since(info, info.last_modified))
+        self.assertFalse(_is_modified_since(
+            info, format_date_time(MTIME_SECONDS + 60)))
+
+    def test_modified_since_earlier_date(self):
+        self.assertTrue(_is_modified_since(
+            file_info(), format_date_time(MTIME_SECONDS - 1)))
+
+    def test_invalid_date_is_modified(self):
+        for header_value in ('', 'yesterday', 'Sat, 32 Foo 2017 00:00:00'):
+            with self.subTest(header_value=header_value):
+                self.assertTrue(_is_modified_since(file_info(), header_value))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import unittest
+
+from httpd import HttpCode, _parse_error_code
+from request_parser import (RequestParser, ParseError, BodyTooLargeError,
+                            HeadersTooLargeError, RequestLineTooLongError,
+                            UnsupportedTransferEncodingError)
+
+GET_REQUEST = b'GET /index.html HTTP/1.1\r\nHost: localhost\r\n\r\n'
+
+
+class RequestParserTests(unittest.TestCase):
+
+    def setUp(self):
+        self.parser = RequestParser(max_request_line_size=64,
+                                    max_header_size=256,
+                                    max_headers_count=4, max_body_size=16)
+
+    def parse(self, data):
+        self.parser.feed(data)
+        return self.parser.next_request()
+
+    def assertParseError(self, data, error_class, http_code):
+        with self.assertRaises(error_class) as context:
+            self.parse(data)
+        self.assertEqual(_parse_error_code(context.exception), http_code)
+
+    def test_request_is_parsed(self):
+        request = self.parse(b'GET /a%20b.html?q=1 HTTP/1.1\r\n'
+                             b'Host: localhost\r\n'
+                             b'Accept-Encoding:gzip \r\n\r\n')
+        self.assertEqual(request.method, 'GET')
+        self.assertEqual(request.resource, '/a%20b.html?q=1')
+        self.assertEqual(request.version, 'HTTP/1.1')
+        self.assertEqual(request.headers, {'host': 'localhost',
+                                           'accept-encoding': 'gzip'})
+        self.assertEqual(request.body, b'')
+        self.assertFalse(self.parser.has_pending_data)
+
+    def test_request_line_without_version_is_http_1_0(self):
+        request = self.parse(b'GET /\r\n\r\n')
+        self.assertEqual(request.version, 'HTTP/1.0')
+
+    def test_empty_lines_before_request_are_skipped(self):
+        request = self.parse(b'\r\n\r\n' + GET_REQUEST)
+        self.assertEqual(request.resource, '/index.html')
+
+    def test_pipelined_requests_stay_buffered(self):
+        post_request = (b'POST /form HTTP/1.1\r\nContent-Length: 5\r\n\r\n'
+                        b'hello')
+        self.parser.feed(post_request + GET_REQUEST + b'HEAD / HTT')
+        first = self.parser.next_request()
+        self.assertEqual((first.method, first.body), ('POST', b'hello'))
+        self.assertTrue(self.parser.has_pending_data)
+        second = self.parser.next_request()
+        self.assertEqual((second.method, second.body), ('GET', b''))
+        self.assertIsNone(self.parser.next_request())
+        self.assertTrue(self.parser.has_pending_data)
+        third = self.parse(b'P/1.1\r\n\r\n')
+        self.assertEqual((third.method, third.resource), ('HEAD', '/'))
+        self.assertFalse(self.parser.has_pending_data)
+
+    def test_head_split_at_any_byte_is_parsed(self):
+        for split in range(1, len(GET_REQUEST)):
+            with self.subTest(split=split):
+                parser = RequestParser()
+                parser.feed(GET_REQUEST[:split])
+                self.assertIsNone(parser.next_request())
+                parser.feed(GET_REQUEST[split:])
+                request = parser.next_request()
+                self.assertEqual(request.headers, {'host': 'localhost'})
+
+    def test_head_ending_fed_byte_by_byte_is_parsed(self):
+        self.assertIsNone(self.parse(GET_REQUEST[:-4]))
+        for byte in (b'\r', b'\n', b'\r'):
+            self.assertIsNone(self.parse(byte))
+        self.assertEqual(self.parse(b'\n').resource, '/index.html')
+
+    def test_body_is_waited_for(self):
+        self.assertIsNone(self.parse(b'POST / HTTP/1.1\r\n'
+                                     b'Content-Length: 4\r\n\r\nab'))
+        self.assertTrue(self.parser.has_pending_data)
+        self.assertEqual(self.parse(b'cd').body, b'abcd')
+
+    def test_long_request_line_is_uri_too_long(self):
+        self.assertParseError(b'GET /' + b'a' * 64, RequestLineTooLongError,
+                              HttpCode.URI_TOO_LONG)
+
+    def test_long_complete_request_line_is_uri_too_long(self):
+        self.assertParseError(b'GET /' + b'a' * 64 + b' HTTP/1.1\r\n\r\n',
+                              RequestLineTooLongError, HttpCode.URI_TOO_LONG)
+
+    def test_large_head_is_headers_too_large(self):
+        self.assertParseError(b'GET / HTTP/1.1\r\nCookie: ' + b'a' * 256,
+                              HeadersTooLargeError,
+                              HttpCode.HEADERS_TOO_LARGE)
+
+    def test_large_complete_head_is_headers_too_large(self):
+        cookie = b'a' * 256
+        self.assertParseError(b'GET / HTTP/1.1\r\nCookie: %s\r\n\r\n' % cookie,
+                              HeadersTooLargeError,
+                              HttpCode.HEADERS_TOO_LARGE)
+
+    def test_too_many_headers_is_headers_too_large(self):
+        headers = b'X-A: 1\r\n' * 5
+        self.assertParseError(b'GET / HTTP/1.1\r\n%s\r\n' % headers,
+                              HeadersTooLargeError,
+                              HttpCode.HEADERS_TOO_LARGE)
+
+    def test_large_body_is_payload_too_large(self):
+        self.assertParseError(b'POST / HTTP/1.1\r\nContent-Length: 17\r\n\r\n',
+                              BodyTooLargeError, HttpCode.PAYLOAD_TOO_LARGE)
+
+    def test_transfer_encoding_is_not_implemented(self):
+        self.assertParseError(b'POST / HTTP/1.1\r\n'
+                              b'Transfer-Encoding: chunked\r\n\r\n',
+                              UnsupportedTransferEncodingError,
+                              HttpCode.NOT_IMPLEMENTED)
+
+    def test_malformed_requests_are_bad_requests(self):
+        for data in (b'GET\r\n\r\n',
+                     b'GET / HTTP/1.1 extra\r\n\r\n',
+                     b'GET / FTP/1.0\r\n\r\n',
+                     b'GET /\xff HTTP/1.1\r\n\r\n',
+                     b'GET / HTTP/1.1\r\nHost: a\r\n folded\r\n\r\n',
+                     b'GET / HTTP/1.1\r\nHost: a\r\n\tfolded\r\n\r\n',
+                     b'GET / HTTP/1.1\r\nno colon\r\n\r\n',
+                     b'GET / HTTP/1.1\r\n: no name\r\n\r\n',
+                     b'GET / HTTP/1.1\r\nHost : a\r\n\r\n',
+                     b'GET / HTTP/1.1\r\nContent-Length: -1\r\n\r\n'):
+            with self.subTest(data=data):
+                self.parser = RequestParser()
+                self.assertParseError(data, ParseError, HttpCode.BAD_REQUEST)
+
+    def test_header_value_may_contain_colons(self):
+        request = self.parse(b'GET / HTTP/1.1\r\nX-Note: a: b\r\n'
+                             b'Referer: http://localhost:8080/\r\n\r\n')
+        self.assertEqual(request.headers['x-note'], 'a: b')
+        self.assertEqual(request.headers['referer'], 'http://localhost:8080/')
+
+    def test_repeated_headers_are_joined(self):
+        request = self.parse(b'GET / HTTP/1.1\r\nAccept: text/html\r\n'
+                             b'accept: */*\r\n\r\n')
+        self.assertEqual(request.headers['accept'], 'text/html, */*')
+
+
+if __name__ == '__main__':
+    unittest.main()
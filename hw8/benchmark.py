@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of the LogisticRegression loss.
+
+Runs gradient steps on batches of a synthetic sparse matrix shaped like
+tf-idf features with the current loss and with the previous implementation
+kept below for reference, and reports iterations per second of both along
+with the share of non finite losses they produce at the given weight scale.
+"""
+import time
+
+import numpy as np
+
+from optparse import OptionParser
+from scipy import sparse
+
+from dmia.classifiers import LogisticRegression
+
+
+def reference_loss(w, X_batch, y_batch, reg):
+    """Loss and gradient as computed before the fused implementation."""
+    dotp = -X_batch.dot(w)
+    odds = 1 / (1 + np.exp(dotp))
+    y_batch = np.array(y_batch)
+    loss = - np.sum(y_batch * np.log(odds)
+                    + (1 - y_batch) * np.log(1 - odds))
+    dw = X_batch.T.dot(odds - y_batch)
+
+    sample_size = X_batch.shape[0]
+    avg_loss = (loss / sample_size
+                + (reg / 2 * sample_size) * (w[:-1].dot(w[:-1])))
+    reg = (reg / sample_size * w[:-1])
+    reg = np.append(reg, 0)
+    avg_grad = dw / sample_size + reg
+    return avg_loss, avg_grad
+
+
+def make_data(num_rows, num_features, row_nnz, seed):
+    rng = np.random.RandomState(seed)
+    indices = rng.randint(0, num_features, num_rows * row_nnz)
+    indptr = np.arange(0, num_rows * row_nnz + 1, row_nnz)
+    X = sparse.csr_matrix((rng.rand(num_rows * row_nnz), indices, indptr),
+                          shape=(num_rows, num_features))
+    X.sum_duplicates()
+    y = rng.randint(0, 2, num_rows)
+    return LogisticRegression.append_biases(X), y
+
+
+def run(loss, X, y, w, batch_size, num_iters, learning_rate, reg):
+    """Runs num_iters gradient steps from w, returns iterations per second
+    and the number of steps with a non finite loss."""
+    w = w.copy()
+    batches = [(X[start:start + batch_size], y[start:start + batch_size])
+               for start in range(0, X.shape[0] - batch_size + 1,
+                                  batch_size)]
+    non_finite = 0
+    started = time.perf_counter()
+    for it in range(num_iters):
+        X_batch, y_batch = batches[it % len(batches)]
+        value, grad = loss(w, X_batch, y_batch, reg)
+        non_finite += not np.isfinite(value)
+        w -= learning_rate * grad
+    return num_iters / (time.perf_counter() - started), non_finite
+
+
+def current_loss(clf):
+    def loss(w, X_batch, y_batch, reg):
+        clf.w = w
+        return clf.loss(X_batch, y_batch, reg)
+    return loss
+
+
+if __name__ == "__main__":
+    parser = OptionParser()
+    parser.add_option("-n", "--rows", action="store", type=int,
+                      default=100000)
+    parser.add_option("-d", "--features", action="store", type=int,
+                      default=3000)
+    parser.add_option("--row-nnz", action="store", type=int, default=20,
+                      help="non zero features per row")
+    parser.add_option("-b", "--batch-size", action="store", type=int,
+                      default=256)
+    parser.add_option("-i", "--iterations", action="store", type=int,
+                      default=2000)
+    parser.add_option("-s", "--weight-scales", action="store", type=str,
+                      default='0.01,100',
+                      help="comma separated scales of initial weights, "
+                           "large ones produce large margins")
+    parser.add_option("--learning-rate", action="store", type=float,
+                      default=0.1)
+    parser.add_option("--reg", action="store", type=float, default=1e-3)
+    parser.add_option("-r", "--repeat", action="store", type=int, default=3,
+                      help="runs of every implementation, the best is shown")
+    (opts, args) = parser.parse_args()
+    X, y = make_data(opts.rows, opts.features, opts.row_nnz, 42)
+    for scale in [float(value) for value in opts.weight_scales.split(',')]:
+        w = np.random.RandomState(0).randn(X.shape[1]) * scale
+        results = {'reference': [], 'fused': []}
+        # runs are interleaved so both see the same machine load
+        for _ in range(opts.repeat):
+            for name, loss in (('reference', reference_loss),
+                               ('fused', current_loss(LogisticRegression()))):
+                with np.errstate(all='ignore'):
+                    results[name].append(run(
+                        loss, X, y, w, opts.batch_size, opts.iterations,
+                        opts.learning_rate, opts.reg))
+        for name, runs in results.items():
+            rate, non_finite = max(runs)
+            print(f'weight scale {scale:g}, {name}: {rate:.0f} it/s, '
+                  f'{non_finite} / {opts.iterations} non finite losses')
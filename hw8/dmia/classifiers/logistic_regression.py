@@ -1,12 +1,75 @@
+import multiprocessing
+
 import numpy as np
 import math
 from scipy import sparse
+from scipy.special import expit
+
+# training matrix and labels of a one-vs-rest worker process
+_worker_data = None
+
+
+def _share(array):
+    """Copies array to shared memory, returns what _unshare needs to view
+    it as an ndarray again."""
+    array = np.ascontiguousarray(array)
+    buffer = multiprocessing.RawArray('B', array.nbytes)
+    np.frombuffer(buffer, dtype=array.dtype)[:] = array.ravel()
+    return buffer, array.dtype.str, array.shape
+
+
+def _unshare(buffer, dtype, shape):
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def _init_worker(data, indices, indptr, shape, labels):
+    """Views the shared CSR matrix and labels without copying them."""
+    global _worker_data
+    X = sparse.csr_matrix((_unshare(*data), _unshare(*indices),
+                           _unshare(*indptr)), shape=shape, copy=False)
+    _worker_data = X, _unshare(*labels)
+
+
+def _shuffled_blocks(num_rows, batch_size):
+    """(start, end) bounds of consecutive row blocks of up to batch_size
+    rows in random order, block boundaries are shifted by a random offset
+    so that batches don't consist of the same rows every epoch."""
+    shift = np.random.randint(batch_size)
+    bounds = np.unique(np.r_[0, np.arange(shift, num_rows, batch_size),
+                             num_rows])
+    blocks = np.column_stack((bounds[:-1], bounds[1:]))
+    return blocks[np.random.permutation(len(blocks))]
+
+
+def _train_class(task):
+    """Trains the binary model of one class in a worker process, returns
+    its weights and loss history."""
+    index, w, seed, params = task
+    X, labels = _worker_data
+    if labels.ndim == 2:
+        y = labels[:, index]
+    else:
+        y = labels == index
+    # forked workers would otherwise shuffle every class the same way
+    np.random.seed(seed)
+    clf = LogisticRegression()
+    clf.w = w
+    # rows of the shared matrix were shuffled once by the parent, batches
+    # are taken as blocks of it instead of a permuted copy per epoch
+    clf._train_epochs(X, y.astype(np.float64), shuffle_rows=False, **params)
+    return clf.w, clf.loss_history
 
 
 class LogisticRegression:
     def __init__(self):
         self.w = None
         self.loss_history = None
+        # labels of the columns of w when trained one-vs-rest
+        self.classes = None
+        self.multilabel = False
+        # per sample and per weight work arrays of loss, reused across steps
+        self._sample_buffers = None
+        self._weight_buffer = None
 
     def train(self, X, y, learning_rate=1e-3, reg=1e-5, num_iters=100,
               batch_size=200, verbose=False):
@@ -28,6 +91,7 @@ class LogisticRegression:
         """
         # Add a column of ones to X for the bias sake.
         X = LogisticRegression.append_biases(X)
+        y = np.asarray(y)
         num_train, dim = X.shape
         if self.w is None:
             # lazily initialize weights
@@ -38,7 +102,7 @@ class LogisticRegression:
         for it in range(num_iters):
             sample_indices = np.random.choice(X.shape[0], batch_size, True)
             X_batch = X[sample_indices, :]
-            y_batch = [y[i] for i in sample_indices]
+            y_batch = y[sample_indices]
             # evaluate loss and gradient
             loss, grad = self.loss(X_batch, y_batch, reg)
             self.loss_history.append(loss)
@@ -49,6 +113,132 @@ class LogisticRegression:
 
         return self
 
+    def train_epochs(self, X, y, learning_rate=1e-3, reg=1e-5, num_epochs=1,
+                     batch_size=200, verbose=False):
+        """
+        Train this classifier using mini-batch gradient descent over epochs.
+
+        Rows are shuffled once per epoch and every epoch steps through all of
+        them in consecutive mini-batches, so a batch is a contiguous row range
+        of the shuffled CSR matrix and labels are sliced from an ndarray
+        rather than gathered row by row.
+
+        Inputs:
+        - X: N x D array of training data. Each row is a D-dimensional point.
+        - y: 1-dimensional array of length N with labels 0-1, for 2 classes.
+        - learning_rate: (float) learning rate for optimization.
+        - reg: (float) regularization strength.
+        - num_epochs: (integer) number of passes over the training data.
+        - batch_size: (integer) number of training examples to use at each step,
+          the last batch of an epoch may be smaller.
+        - verbose: (boolean) If true, print average loss of every epoch.
+
+        Outputs:
+        self, loss_history contains the value of the loss function at each
+        step.
+        """
+        X = LogisticRegression.append_biases(X)
+        y = np.asarray(y, dtype=np.float64)
+        if self.w is None:
+            # lazily initialize weights
+            self.w = np.random.randn(X.shape[1]) * 0.01
+        return self._train_epochs(X, y, learning_rate, reg, num_epochs,
+                                  batch_size, verbose)
+
+    def _train_epochs(self, X, y, learning_rate, reg, num_epochs, batch_size,
+                      verbose, shuffle_rows=True):
+        """Runs the epochs of train_epochs. Without shuffle_rows X is never
+        copied: every epoch takes its row blocks in another order, rows are
+        expected to be shuffled by the caller."""
+        num_train = X.shape[0]
+        self.loss_history = []
+        for epoch in range(num_epochs):
+            if shuffle_rows:
+                order = np.random.permutation(num_train)
+                X_epoch = X[order]
+                y_epoch = y[order]
+                starts = np.arange(0, num_train, batch_size)
+                blocks = np.column_stack((starts, starts + batch_size))
+            else:
+                X_epoch, y_epoch = X, y
+                blocks = _shuffled_blocks(num_train, batch_size)
+            for start, end in blocks:
+                loss, grad = self.loss(X_epoch[start:end], y_epoch[start:end],
+                                       reg)
+                self.loss_history.append(loss)
+                self.w -= learning_rate * grad
+
+            if verbose:
+                print('epoch %d / %d: loss %f' % (
+                    epoch, num_epochs,
+                    np.mean(self.loss_history[-len(blocks):])))
+
+        return self
+
+    def train_one_vs_rest(self, X, y, learning_rate=1e-3, reg=1e-5,
+                          num_epochs=1, batch_size=200, n_jobs=None,
+                          verbose=False):
+        """
+        Train a binary classifier per class with train_epochs, in parallel.
+
+        Rows are shuffled once and the training matrix and labels are copied
+        to shared memory, viewed by a pool of worker processes; each task
+        trains the model of one class and returns its weights. Workers never
+        copy the matrix, every epoch steps through blocks of batch_size
+        consecutive rows in a new random order.
+
+        Inputs:
+        - X: N x D array of training data. Each row is a D-dimensional point.
+        - y: 1-dimensional array of length N with labels of any number of
+          classes, or N x K 0-1 array of K labels for multi-label tasks.
+        - learning_rate: (float) learning rate for optimization.
+        - reg: (float) regularization strength.
+        - num_epochs: (integer) number of passes over the training data.
+        - batch_size: (integer) number of training examples to use at each step.
+        - n_jobs: (integer) number of worker processes, CPU count by default.
+        - verbose: (boolean) If true, print final loss of every class.
+
+        Outputs:
+        self, w is a (D + 1) x K array with weights of a class in every
+        column, classes holds labels of the columns and loss_history the
+        loss history of every class.
+        """
+        X = LogisticRegression.append_biases(X)
+        y = np.asarray(y)
+        if y.ndim == 2:
+            classes = np.arange(y.shape[1])
+            labels = y
+        else:
+            classes, labels = np.unique(y, return_inverse=True)
+        num_classes = len(classes)
+        order = np.random.permutation(X.shape[0])
+        X, labels = X[order], labels[order]
+        if self.w is None or self.w.shape != (X.shape[1], num_classes):
+            self.w = np.random.randn(X.shape[1], num_classes) * 0.01
+        self.classes = classes
+        self.multilabel = y.ndim == 2
+
+        params = {'learning_rate': learning_rate, 'reg': reg,
+                  'num_epochs': num_epochs, 'batch_size': batch_size,
+                  'verbose': False}
+        seeds = np.random.randint(2 ** 31, size=num_classes)
+        tasks = [(index, self.w[:, index].copy(), seeds[index], params)
+                 for index in range(num_classes)]
+        processes = min(n_jobs or multiprocessing.cpu_count(), num_classes)
+        initargs = (_share(X.data), _share(X.indices), _share(X.indptr),
+                    X.shape, _share(labels))
+        with multiprocessing.Pool(processes, _init_worker, initargs) as pool:
+            results = pool.map(_train_class, tasks)
+
+        self.loss_history = []
+        for index, (w, loss_history) in enumerate(results):
+            self.w[:, index] = w
+            self.loss_history.append(loss_history)
+            if verbose:
+                print('class %s: loss %f' % (classes[index], loss_history[-1]))
+
+        return self
+
     def predict_proba(self, X, append_bias=False):
         """
         Use the trained weights of this linear classifier to predict probabilities for
@@ -61,13 +251,18 @@ class LogisticRegression:
         Returns:
         - y_proba: Probabilities of classes for the data in X. y_pred is a 2-dimensional
           array with a shape (N, 2), and each row is a distribution of classes [prob_class_0, prob_class_1].
+          Trained one-vs-rest, it has a shape (N, K): rows are distributions
+          of classes, for multi-label tasks probabilities of every label.
         """
         if append_bias:
             X = LogisticRegression.append_biases(X)
-        dotp = -X.dot(self.w)
-        p_1 = 1 / (1 + np.exp(dotp))
-        p_0 = np.subtract(1, p_1)
-        return np.transpose(np.vstack((p_0, p_1)))
+        # margins of all classes at once, N x K for one-vs-rest weights
+        y_proba = expit(X.dot(self.w))
+        if self.w.ndim == 1:
+            return np.column_stack((1 - y_proba, y_proba))
+        if not self.multilabel:
+            y_proba /= y_proba.sum(axis=1, keepdims=True)
+        return y_proba
 
     def predict(self, X):
         """
@@ -79,11 +274,15 @@ class LogisticRegression:
         Returns:
         - y_pred: Predicted labels for the data in X. y_pred is a 1-dimensional
           array of length N, and each element is an integer giving the predicted
-          class.
+          class, or one of classes when trained one-vs-rest. For multi-label
+          tasks it is an N x K 0-1 array of predicted labels.
         """
 
         y_proba = self.predict_proba(X, append_bias=True)
-        return np.greater(y_proba[:, 0], y_proba[:, 1]).astype(int)
+        if self.multilabel:
+            return (y_proba >= 0.5).astype(int)
+        y_pred = np.argmax(y_proba, axis=1)
+        return y_pred if self.classes is None else self.classes[y_pred]
 
     def loss(self, X_batch, y_batch, reg):
         """Logistic Regression loss function
@@ -96,19 +295,45 @@ class LogisticRegression:
         - loss as single float
         - gradient with respect to weights w; an array of same shape as w
         """
-        dotp = -X_batch.dot(self.w)
-        odds = 1 / (1 + np.exp(dotp))
-        y_batch = np.array(y_batch)
-        loss = - np.sum(y_batch * np.log(odds) + (1 - y_batch) * np.log(1 - odds))
-        dw = X_batch.T.dot(odds - y_batch)
-
+        y_batch = np.asarray(y_batch)
         sample_size = X_batch.shape[0]
-        avg_loss = loss/sample_size + (reg/2*sample_size)*(self.w[:-1].dot(self.w[:-1]))
-        reg = (reg/sample_size * self.w[:-1])
-        reg = np.append(reg, 0)  # exclude bias term
-        avg_grad = dw / sample_size + reg
+        margins = X_batch.dot(self.w)
+        softplus, residuals, reg_grad = self._loss_buffers(sample_size)
+        # -log P(y | x) = log(1 + exp(z)) - y * z for both labels, computed
+        # as log-sum-exp max(z, 0) + log(1 + exp(-|z|)) that can't overflow;
+        # it's the same as np.logaddexp(0, z), which is several times slower
+        np.abs(margins, out=softplus)
+        np.negative(softplus, out=softplus)
+        np.exp(softplus, out=softplus)
+        np.log1p(softplus, out=softplus)
+        np.maximum(margins, 0, out=residuals)
+        softplus += residuals
+        loss = softplus.sum() - y_batch.dot(margins)
+        # sigmoid(z) = exp(z - log(1 + exp(z))), the exponent is never positive
+        np.subtract(margins, softplus, out=residuals)
+        np.exp(residuals, out=residuals)
+        residuals -= y_batch
+        avg_grad = X_batch.T.dot(residuals)
+        avg_grad /= sample_size
+
+        w = self.w[:-1]  # exclude bias term
+        avg_loss = loss / sample_size + reg / (2 * sample_size) * w.dot(w)
+        np.multiply(w, reg / sample_size, out=reg_grad)
+        avg_grad[:-1] += reg_grad
         return avg_loss, avg_grad
 
+    def _loss_buffers(self, sample_size):
+        """Work arrays for a batch of sample_size, allocated again only
+        for a larger batch or another number of weights."""
+        if (self._sample_buffers is None
+                or self._sample_buffers.shape[1] < sample_size):
+            self._sample_buffers = np.empty((2, sample_size))
+        if (self._weight_buffer is None
+                or self._weight_buffer.shape[0] != self.w.shape[0] - 1):
+            self._weight_buffer = np.empty(self.w.shape[0] - 1)
+        softplus, residuals = self._sample_buffers[:, :sample_size]
+        return softplus, residuals, self._weight_buffer
+
     @staticmethod
     def append_biases(X):
         return sparse.hstack((X, np.ones(X.shape[0])[:, np.newaxis])).tocsr()
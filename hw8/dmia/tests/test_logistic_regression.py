@@ -0,0 +1,118 @@
+import contextlib
+import io
+import unittest
+
+import numpy as np
+from scipy import sparse
+
+from ..classifiers import LogisticRegression
+from ..gradient_check import eval_numerical_gradient
+
+
+def batch(rng, num_rows=20, num_features=4):
+    X = sparse.random(num_rows, num_features, density=0.5, format='csr',
+                      random_state=rng)
+    y = (rng.rand(num_rows) > 0.5).astype(np.float64)
+    return LogisticRegression.append_biases(X), y
+
+
+def separable_set(rng, num_classes, rows_per_class=30):
+    """Sparse points scattered around a vertex of a simplex per class."""
+    y = np.repeat(np.arange(num_classes), rows_per_class)
+    X = 4 * np.eye(num_classes)[y] + 0.5 * rng.randn(len(y), num_classes)
+    order = rng.permutation(len(y))
+    return sparse.csr_matrix(X[order]), y[order]
+
+
+class LossTests(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.X, self.y = batch(rng)
+        self.clf = LogisticRegression()
+        self.clf.w = rng.randn(self.X.shape[1])
+
+    def reference_loss(self, reg):
+        w = self.clf.w
+        margins = self.X.dot(w)
+        loss = np.mean(np.logaddexp(0, margins) - self.y * margins)
+        return loss + reg / (2 * len(self.y)) * w[:-1].dot(w[:-1])
+
+    def test_gradient_matches_numerical_gradient(self):
+        _, grad = self.clf.loss(self.X, self.y, 0.1)
+        # eval_numerical_gradient shifts clf.w in place and prints every
+        # partial derivative
+        with contextlib.redirect_stdout(io.StringIO()):
+            numerical_grad = eval_numerical_gradient(
+                lambda w: self.clf.loss(self.X, self.y, 0.1)[0], self.clf.w)
+        np.testing.assert_allclose(grad, numerical_grad, rtol=1e-4,
+                                   atol=1e-5)
+
+    def test_loss_matches_reference(self):
+        loss, _ = self.clf.loss(self.X, self.y, 0.1)
+        self.assertAlmostEqual(loss, self.reference_loss(0.1))
+
+    def test_loss_is_finite_at_large_margins(self):
+        self.clf.w *= 1e4
+        loss, grad = self.clf.loss(self.X, self.y, 0.1)
+        self.assertTrue(np.isfinite(loss))
+        self.assertTrue(np.isfinite(grad).all())
+        np.testing.assert_allclose(loss, self.reference_loss(0.1))
+
+
+class TrainEpochsTests(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.X, self.y = separable_set(np.random.RandomState(0), 2)
+
+    def test_labels_are_recovered(self):
+        clf = LogisticRegression().train_epochs(
+            self.X, self.y, learning_rate=1.0, num_epochs=20, batch_size=16)
+        y_proba = clf.predict_proba(self.X, append_bias=True)
+        np.testing.assert_array_equal(y_proba[:, 1] > 0.5, self.y)
+
+    def test_epoch_steps_through_all_batches(self):
+        clf = LogisticRegression().train_epochs(
+            self.X, self.y, num_epochs=3, batch_size=16)
+        # 60 rows in batches of 16 are 4 steps per epoch
+        self.assertEqual(len(clf.loss_history), 12)
+
+
+class OneVsRestTests(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(0)
+        self.X, self.y = separable_set(np.random.RandomState(0), 3)
+
+    def train(self, y, n_jobs):
+        return LogisticRegression().train_one_vs_rest(
+            self.X, y, learning_rate=1.0, num_epochs=20, batch_size=16,
+            n_jobs=n_jobs)
+
+    def test_labels_are_recovered(self):
+        for n_jobs in (1, 2):
+            with self.subTest(n_jobs=n_jobs):
+                clf = self.train(self.y, n_jobs)
+                self.assertEqual(clf.w.shape, (4, 3))
+                np.testing.assert_array_equal(clf.predict(self.X), self.y)
+
+    def test_class_labels_are_predicted(self):
+        names = np.array(['a', 'b', 'c'])
+        clf = self.train(names[self.y], 2)
+        np.testing.assert_array_equal(clf.predict(self.X), names[self.y])
+
+    def test_multilabel_labels_are_recovered(self):
+        labels = np.eye(3, dtype=int)[self.y]
+        clf = self.train(labels, 2)
+        np.testing.assert_array_equal(clf.predict(self.X), labels)
+
+    def test_binary_model_predicts_labels(self):
+        X, y = separable_set(np.random.RandomState(1), 2)
+        clf = LogisticRegression().train_epochs(
+            X, y, learning_rate=1.0, num_epochs=20, batch_size=16)
+        np.testing.assert_array_equal(clf.predict(X), y)
+
+
+if __name__ == '__main__':
+    unittest.main()